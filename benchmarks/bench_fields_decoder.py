@@ -0,0 +1,65 @@
+"""Decode throughput of the schema-compiled dispatch table against the previous per-field lookup loop, on the full main region.
+
+Run from the repository root: python -m benchmarks.bench_fields_decoder
+"""
+import io
+import timeit
+import cbor2
+
+from octoprint_clothopus.OPTag.fields import Fields, EnumField, EnumArrayField
+from octoprint_clothopus.OPTag.record import Record
+from octoprint_clothopus.OPTag.common import default_config_file
+from benchmarks.sample_tag import SAMPLE_TAG
+
+
+def legacy_decode_map(fields: Fields, data: dict, out_unknown_fields: dict = None) -> dict:
+    """The decode loop Fields.decode_map used before (field lookup and dict-based enum resolution for every key)"""
+    result = dict()
+    for key, value in data.items():
+        field = fields.fields_by_key.get(key)
+
+        if field is None and out_unknown_fields is not None:
+            out_unknown_fields[key] = value
+            continue
+
+        assert field, f"Unknown CBOR key '{key}'"
+
+        try:
+            if isinstance(field, EnumArrayField):
+                result[field.name] = [field.items_by_key[item] for item in value]
+            elif isinstance(field, EnumField):
+                result[field.name] = field.items_by_key[value]
+            else:
+                result[field.name] = field.decode(value)
+        except Exception as e:
+            e.add_note(f"Field {key} {field.name}")
+            raise
+
+    return result
+
+
+def main():
+    record = Record(default_config_file, memoryview(bytearray(SAMPLE_TAG)))
+    region = record.main_region
+    fields = region.fields
+
+    encoded = bytes(region.memory)
+    raw_map = cbor2.loads(encoded)
+    assert legacy_decode_map(fields, raw_map, dict()) == fields.decode_map(raw_map, dict()), "Decoded data differs"
+
+    number = 20000
+    cases = {
+        "legacy decode_map": lambda: legacy_decode_map(fields, raw_map, dict()),
+        "dispatch decode_map": lambda: fields.decode_map(raw_map, dict()),
+        "legacy decode (with cbor2)": lambda: legacy_decode_map(fields, cbor2.load(io.BytesIO(encoded)), dict()),
+        "dispatch decode (with cbor2)": lambda: fields.decode(io.BytesIO(encoded), dict()),
+    }
+
+    print(f"main region: {len(raw_map)} fields, {len(encoded)} B")
+    for name, func in cases.items():
+        per_call = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print(f"{name:30} {1 / per_call:10.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Throughput of the schema-compiled CBOR encoder against the generic cbor2 path, on realistic main and aux payloads.
+
+Run from the repository root: python -m benchmarks.bench_fields_encoder
+"""
+import timeit
+
+from octoprint_clothopus.OPTag.fields import EncodeConfig, encode_generic
+from octoprint_clothopus.OPTag.record import Record
+from octoprint_clothopus.OPTag.common import default_config_file
+from benchmarks.sample_tag import SAMPLE_TAG
+
+
+def prepared_map(region, update_fields: dict, config: EncodeConfig) -> dict:
+    """Returns the map Fields.update hands to the encoder, by capturing it"""
+    captured = dict()
+    encoder = region.fields.encoder
+    original_encode = encoder.encode
+
+    def capture(data, config):
+        captured.update(data)
+        return original_encode(data, config)
+
+    encoder.encode = capture
+    try:
+        region.fields.update(original_map=dict(region._decode_raw()[0]), update_fields=update_fields, config=config)
+    finally:
+        del encoder.encode
+
+    return captured
+
+
+def main():
+    record = Record(default_config_file, memoryview(bytearray(SAMPLE_TAG)))
+    config = EncodeConfig()
+    stable_config = EncodeConfig(stable_width_fields=frozenset(["consumed_weight"]))
+
+    payloads = {
+        "main": (record.main_region, {}, config),
+        "aux": (record.aux_region, {"consumed_weight": 1234.567, "workgroup": "clotho"}, config),
+        "aux (stable width)": (record.aux_region, {"consumed_weight": 1234.567, "workgroup": "clotho"}, stable_config),
+    }
+
+    number = 5000
+    for name, (region, update_fields, cfg) in payloads.items():
+        data = prepared_map(region, update_fields, cfg)
+        compiled = region.fields.encoder.encode(data, cfg)
+        assert compiled == encode_generic(data, cfg), "Compiled encoder output differs"
+
+        generic_time = min(timeit.repeat(lambda: encode_generic(data, cfg), number=number, repeat=5)) / number
+        compiled_time = min(timeit.repeat(lambda: region.fields.encoder.encode(data, cfg), number=number, repeat=5)) / number
+
+        print(f"{name:20} {len(compiled):4} B   generic {1 / generic_time:10.0f} ops/s   compiled {1 / compiled_time:10.0f} ops/s   ({generic_time / compiled_time:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measures what importing the plugin adds to the OctoPrint startup, based on python -X importtime.
+
+OctoPrint has already imported its own modules and flask when it loads the plugin, so those are imported first and
+don't count. Fails if the plugin takes longer than the budget or imports one of the heavy dependencies that are
+supposed to be loaded on first use (see warmup.HEAVY_MODULES).
+
+Run from the repository root: python -m benchmarks.bench_import [--budget-ms 50]
+"""
+import argparse
+import subprocess
+import sys
+
+# Imported by OctoPrint before it loads any plugin
+PRELOADED = ("octoprint.plugin", "octoprint.events", "flask")
+
+# Never to be imported while loading the plugin
+DEFERRED = ("pandas", "numpy", "sklearn", "httpx", "yaml", "cbor2", "ndef", "octoprint_clothopus.OPTag")
+
+DEFAULT_BUDGET_MS = 50.0
+
+
+def import_times() -> dict[str, tuple[int, int]]:
+    """module -> (self, cumulative) microseconds of everything the plugin import loaded"""
+    code = f"import {', '.join(PRELOADED)}; import octoprint_clothopus"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+
+    times = dict()
+    lines = proc.stderr.splitlines()
+    # Only the lines after the preloaded modules are loaded by the plugin import
+    start = max(i for i, line in enumerate(lines) if line.rsplit("|", 1)[-1].strip() in PRELOADED) + 1
+    for line in lines[start:]:
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # The fastest run is the one least disturbed by the rest of the system
+    runs = [import_times() for _ in range(args.repeat)]
+    times = min(runs, key=lambda times: times["octoprint_clothopus"][1])
+    total_ms = times["octoprint_clothopus"][1] / 1e3
+
+    print(f"octoprint_clothopus {total_ms:7.1f} ms (budget {args.budget_ms:.1f} ms)")
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    for module, (own, cumulative) in slowest:
+        print(f"  {module:40} self {own / 1e3:6.1f} ms   cumulative {cumulative / 1e3:6.1f} ms")
+
+    loaded = [module for module in DEFERRED if module in times]
+    if loaded:
+        print(f"Heavy dependencies imported at load time: {', '.join(loaded)}")
+
+    if loaded or total_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
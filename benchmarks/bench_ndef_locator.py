@@ -0,0 +1,80 @@
+"""Compares the zero-copy TLV/NDEF locator with the previous BytesIO + ndef.message_decoder path.
+
+Run from the repository root: python -m benchmarks.bench_ndef_locator
+"""
+import io
+import timeit
+import ndef
+
+from octoprint_clothopus.OPTag.ndef_locator import find_ndef_message, iter_ndef_records, is_media_record, decode_ndef_record
+from benchmarks.sample_tag import SAMPLE_TAG
+
+MIME_TYPE = "application/vnd.openprinttag"
+
+
+def legacy_locate(data: memoryview):
+    """The payload lookup Record.__init__ used before (copies the image and decodes every record)"""
+    data_io = io.BytesIO(data)
+    cc = data_io.read(4)
+    assert cc[0] == 0xE1
+
+    while True:
+        base_tlv = data_io.read(2)
+        tag = base_tlv[0]
+        tlv_len = base_tlv[1]
+
+        if tlv_len == 0xFF:
+            ext_len = data_io.read(2)
+            tlv_len = ext_len[0] * 256 | ext_len[1]
+
+        if tag == 0x03:
+            break
+        else:
+            data_io.seek(tlv_len, 1)
+
+    uri = None
+    for record in ndef.message_decoder(data_io):
+        if type(record) is ndef.UriRecord:
+            uri = record.uri
+
+        if record.type == MIME_TYPE:
+            end = data_io.tell()
+            payload_offset = end - len(record.data)
+            payload = data[payload_offset:end]
+            assert payload == record.data
+            return payload_offset, uri
+
+
+def locate(data: memoryview, with_uri: bool = True):
+    message_offset, message_length = find_ndef_message(data)
+    mime_type = MIME_TYPE.encode()
+
+    uri = None
+    for location in iter_ndef_records(data, message_offset, message_offset + message_length):
+        if is_media_record(data, location, mime_type):
+            return location.payload_offset, uri
+
+        if with_uri and type(record := decode_ndef_record(data, location)) is ndef.UriRecord:
+            uri = record.uri
+
+
+def main():
+    data = memoryview(bytearray(SAMPLE_TAG))
+    assert legacy_locate(data) == locate(data)
+
+    number = 20000
+    cases = {
+        "legacy (BytesIO + message_decoder)": lambda: legacy_locate(data),
+        "locator (with URI record decode)": lambda: locate(data),
+        "locator (payload offset only)": lambda: locate(data, with_uri=False),
+    }
+
+    baseline = None
+    for name, func in cases.items():
+        per_call = min(timeit.repeat(func, number=number, repeat=5)) / number
+        baseline = baseline or per_call
+        print(f"{name:40} {per_call * 1e6:8.2f} us  ({baseline / per_call:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compares the block-wise recursive forecast with the previous day-by-day loop (one pandas row and model.predict call per day).
+
+Run from the repository root: python -m benchmarks.bench_predictor
+"""
+import random
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from octoprint_clothopus.predictor import FORECAST_FEATURES, forecast_recursive, predict_runout_from_tuples
+
+
+def legacy_forecast(model, consumption: np.ndarray, first_date: pd.Timestamp, latest_date: pd.Timestamp, current_consumed: float, total_material_weight, max_forecast_days: int = 365) -> pd.DataFrame:
+    """The forecast loop predict_runout_cumulative used before"""
+    cumulative_consumed = current_consumed
+    consumption_history = list(consumption)
+    forecast = []
+
+    for i in range(1, max_forecast_days + 1):
+        future_date = latest_date + pd.Timedelta(days=i)
+        recent = pd.Series(consumption_history)
+
+        row = {
+            "day_index": (future_date - first_date).days,
+            "weekday": future_date.weekday(),
+            "is_weekend": int(future_date.weekday() in [5, 6]),
+            "month": future_date.month,
+            "year_sin": np.sin(2 * np.pi * future_date.dayofyear / 365.25),
+            "year_cos": np.cos(2 * np.pi * future_date.dayofyear / 365.25),
+            "consumption_lag_1": recent.iloc[-1],
+            "consumption_lag_7": recent.iloc[-7] if len(recent) >= 7 else recent.mean(),
+            "consumption_avg_7": recent.tail(7).mean(),
+            "consumption_avg_28": recent.tail(28).mean(),
+        }
+
+        predicted_daily_consumption = max(0, float(model.predict(pd.DataFrame([row])[FORECAST_FEATURES])[0]))
+        cumulative_consumed += predicted_daily_consumption
+        consumption_history.append(predicted_daily_consumption)
+
+        forecast.append({
+            "date": future_date,
+            "predicted_daily_consumption": predicted_daily_consumption,
+            "predicted_cumulative_consumed": cumulative_consumed,
+            "predicted_remaining_weight": total_material_weight - cumulative_consumed,
+        })
+
+        if cumulative_consumed >= total_material_weight:
+            break
+
+    return pd.DataFrame(forecast)
+
+
+def history(days: int, seed: int) -> list[tuple[int, float]]:
+    rng = random.Random(seed)
+    consumed = 0
+    data = []
+    for i in range(days):
+        # Weekday printing with some idle days
+        if i % 7 < 5 and rng.random() < 0.8:
+            consumed += rng.randint(2, 25)
+        data.append((20600 + i, consumed))
+    return data
+
+
+def main():
+    cases = {
+        "60 days, early runout": (history(60, 1), 1500),
+        "120 days, varying forecast": (history(120, 2), 6000),
+        "30 days, steady forecast": (history(30, 3), 100000),
+    }
+
+    for name, (data, total) in cases.items():
+        result = predict_runout_from_tuples(data, total)
+        model = result["model"]
+
+        # Same inputs predict_runout_cumulative hands to the forecast
+        df = pd.DataFrame(data, columns=["x", "y"])
+        df.index = pd.to_datetime(df["x"], unit="D", origin="unix")
+        consumption = df["y"].diff().clip(lower=0).dropna()
+        args = (model, consumption.to_numpy(dtype=float), consumption.index.min(), consumption.index[-1], float(df["y"].iloc[-1]), total)
+
+        legacy = legacy_forecast(*args)
+        blocked = forecast_recursive(*args)
+        assert legacy["date"].tolist() == blocked["date"].tolist(), "Forecast dates differ"
+        assert np.array_equal(legacy["predicted_cumulative_consumed"].to_numpy(), blocked["predicted_cumulative_consumed"].to_numpy()), "Forecasts differ"
+
+        legacy_time = min(timeit.repeat(lambda: legacy_forecast(*args), number=1, repeat=3))
+        blocked_time = min(timeit.repeat(lambda: forecast_recursive(*args), number=5, repeat=3)) / 5
+        runout = result["runout_date"].strftime("%d.%m.%Y") if result["runout_date"] is not None else "none"
+
+        print(f"{name:34} {len(blocked):3} days, runout {runout:10}   legacy {legacy_time * 1e3:8.1f} ms   blocked {blocked_time * 1e3:7.1f} ms   ({legacy_time / blocked_time:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
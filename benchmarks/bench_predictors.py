@@ -0,0 +1,38 @@
+"""Compares the fast smoothing predictor with the accurate gradient boosting one, by time and predicted runout date.
+
+Run from the repository root: python -m benchmarks.bench_predictors
+"""
+import timeit
+
+from octoprint_clothopus.predictors import PREDICTORS
+
+from .bench_predictor import history
+
+
+def main():
+    cases = {
+        "3 days": (history(3, 4), 1000),
+        "10 days": (history(10, 5), 1000),
+        "30 days": (history(30, 3), 2000),
+        "60 days": (history(60, 1), 1500),
+        "120 days": (history(120, 2), 6000),
+    }
+
+    for name, (data, total) in cases.items():
+        line = f"{name:10}"
+        for predictor in PREDICTORS.values():
+            try:
+                result = predictor.predict(data, total)
+            except ValueError:
+                line += f"   {predictor.name:8} {'too short':10} {'':>10}"
+                continue
+
+            seconds = min(timeit.repeat(lambda: predictor.predict(data, total), number=5, repeat=3)) / 5
+            runout = result["runout_date"].strftime("%d.%m.%Y") if result["runout_date"] is not None else "none"
+            line += f"   {predictor.name:8} {runout:10} {seconds * 1e6:7.0f} us"
+
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Drives the plugin's poll against mock stacks over real HTTP, with the default settings.
+
+Fails if a poll doesn't succeed or a consumed weight doesn't end up on the tag. Stacks with the combined /state
+endpoint and legacy ones have to end up with the same weights.
+
+Run from the repository root: python -m benchmarks.check_mockstack
+"""
+import logging
+
+import octoprint_clothopus
+from octoprint_clothopus.mockstack import MockStack, serve
+from octoprint_clothopus.OPTag import PrintTagHandler
+from octoprint_clothopus.stackstate import consumed_weight
+
+from .sample_tag import SAMPLE_TAG
+
+
+class Settings:
+    """The plugin's settings defaults, without OctoPrint's settings storage"""
+
+    def __init__(self, values: dict):
+        self.values = values
+
+    def get(self, path: list):
+        return self.values.get(path[0])
+
+    get_int = get_float = get_boolean = get
+
+    def set(self, path: list, value):
+        self.values[path[0]] = value
+
+    def save(self):
+        pass
+
+
+class PluginManager:
+    def __init__(self):
+        self.messages = []
+
+    def send_plugin_message(self, identifier: str, message: dict):
+        self.messages.append(message)
+
+
+def create_plugin(stacks: dict[str, MockStack]) -> octoprint_clothopus.ClothopusPlugin:
+    """A plugin polling the stacks, each served on its own port"""
+    plugin = octoprint_clothopus.ClothopusPlugin()
+    plugin._settings = Settings(plugin.get_settings_defaults())
+    plugin._plugin_manager = PluginManager()
+    plugin._identifier = "clothopus"
+    plugin._logger = logging.getLogger("clothopus")
+
+    servers = {mac: serve(stack) for mac, stack in stacks.items()}
+    plugin._settings.set(["stacks"], {mac: f"127.0.0.1:{server.server_address[1]}" for mac, server in servers.items()})
+    return plugin
+
+
+def check_default_write(plugin: octoprint_clothopus.ClothopusPlugin, stack: MockStack):
+    """A single poll writes the consumed weight with the default (full image) writes"""
+    assert not plugin._settings.get_boolean(["block_edit_writes"]), "Not the default write path"
+    image = bytes(stack.image)
+
+    snapshot = plugin.stack_client.run(plugin._poll())
+    assert snapshot["success"], f"Poll failed: {snapshot}"
+    assert stack.requests[("POST", "/blocks")] == 1, "Consumed weight wasn't written"
+    assert bytes(stack.image) != image, "Tag image unchanged after the write"
+
+
+def check_broken_tag(plugin: octoprint_clothopus.ClothopusPlugin, good: str, broken: str):
+    """A tag that isn't an OpenPrintTag only gets an error on its own row"""
+    snapshot = plugin.stack_client.run(plugin._poll())
+    assert snapshot["success"], f"Poll failed: {snapshot}"
+    rows = {row["mac"]: row for row in snapshot["rows"]}
+    assert "error" not in rows[good], f"{good} has an error: {rows[good]}"
+    assert "error" in rows[broken], f"{broken} has no error: {rows[broken]}"
+
+
+def tag_weight(image: bytes) -> tuple[float, dict]:
+    """Consumed weight on the tag and its main region"""
+    handler = PrintTagHandler()
+    handler.current_record = bytearray(image)
+    main = handler.current_record.main_region.read(out_unknown_fields=dict())
+    return handler.current_record.aux_region.read(out_unknown_fields=dict()).get("consumed_weight", 0), main
+
+
+def check_round_trip(plugin: octoprint_clothopus.ClothopusPlugin, stacks: dict[str, MockStack], length: float):
+    """Consumes length mm on every stack, then the poll writes the weight to the tags and the next one reads it back unchanged"""
+    expected = dict()
+    for mac, stack in stacks.items():
+        weight, main = tag_weight(stack.image)
+        expected[mac] = weight + consumed_weight(length, main.get("filament_diameter", 1.75), main["density"])
+        stack.consume(length)
+
+    writes = {mac: stack.requests[("POST", "/blocks")] for mac, stack in stacks.items()}
+    snapshot = plugin.stack_client.run(plugin._poll())
+    assert snapshot["success"], f"Poll failed: {snapshot}"
+
+    for mac, stack in stacks.items():
+        assert stack.requests[("POST", "/blocks")] == writes[mac] + 1, f"Consumed weight of {mac} wasn't written"
+        assert stack.consumed_length == 0, f"Counter of {mac} wasn't reset by the write"
+        weight, _ = tag_weight(stack.image)
+        assert abs(weight - expected[mac]) < 1e-3, f"{mac} has {weight} g on the tag instead of {expected[mac]} g"
+
+    # Nothing consumed since, the reread shows the written weight and doesn't write again
+    snapshot = plugin.stack_client.run(plugin._poll())
+    assert snapshot["success"], f"Poll failed: {snapshot}"
+    rows = {row["mac"]: row for row in snapshot["rows"]}
+    for mac, stack in stacks.items():
+        assert stack.requests[("POST", "/blocks")] == writes[mac] + 1, f"{mac} was written without consumption"
+        shown = rows[mac]["data"]["aux"]["consumed_weight"]
+        assert abs(shown - expected[mac]) < 1e-3, f"{mac} shows {shown} g instead of {expected[mac]} g"
+
+
+def main():
+    stack = MockStack(SAMPLE_TAG, uid="E0040150AABBCC01")
+    plugin = create_plugin({"aa:01": stack})
+    # The write threshold is reached with the first poll
+    stack.consume(10000)
+
+    plugin.stack_client.start()
+    try:
+        check_default_write(plugin, stack)
+    finally:
+        plugin.stack_client.close()
+
+    # Zeroed tag next to a good one
+    plugin = create_plugin({"aa:04": MockStack(SAMPLE_TAG), "aa:05": MockStack(bytes(len(SAMPLE_TAG)))})
+    plugin.stack_client.start()
+    try:
+        check_broken_tag(plugin, "aa:04", "aa:05")
+    finally:
+        plugin.stack_client.close()
+
+    # Default full image writes, then the opt-in block edits
+    for block_edit_writes in (False, True):
+        stacks = {
+            "aa:02": MockStack(SAMPLE_TAG, uid="E0040150AABBCC02"),
+            "aa:03": MockStack(SAMPLE_TAG, uid="E0040150AABBCC03", supports_state=False),
+        }
+        plugin = create_plugin(stacks)
+        plugin._settings.set(["block_edit_writes"], block_edit_writes)
+        plugin.stack_client.start()
+        try:
+            for length in (10000, 2500, 40000):
+                check_round_trip(plugin, stacks, length)
+        finally:
+            plugin.stack_client.close()
+
+        weights = {mac: tag_weight(stack.image)[0] for mac, stack in stacks.items()}
+        assert len(set(weights.values())) == 1, f"/state and legacy stacks differ: {weights}"
+
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
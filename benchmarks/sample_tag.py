@@ -0,0 +1,2 @@
+# Sample OpenPrintTag image (Prusament PETG, 320 B NFC-V tag), same as in OPTag/taghandler.py
+SAMPLE_TAG = b'\xe1@\'\x01\x03\xff\x01/\x91\x01\x17U\x043dtag.org/s/c38f06345dR\x1c\xf5application/vnd.openprinttag\xa1\x02\x18\xd2\xbf\x04\x1b\x00\x00\x07\xd0\xfc\xabFV\x05jc38f06345d\x08\x00\t\x01\nqPETG Prusa Orange\x0biPrusament\x0e\x1ah\xf9\x0e\xa3\x10\x19\x03\xe8\x11\x19\x03\xf9\x12\x19\x01\x15\x13C\xebT\x05\x18\x1c\x9f\xff\x18\x1d\xf9=\x14\x18"\x18\xf0\x18#\x19\x01\x04\x18$\x18\xaa\x18%\x18F\x18&\x18Z\x18\'\x12\x18(\x18<\x18)\x18#\x18*\x18C\x18+\x18\xc8\x18,\x18e\x18-\x183\x185\x1a\x00\x05\x04\xf3\x186\x1a\x00\x05\x1a\xcd\xff\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xa0\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xfe\x00\x00\x00\x00\x00\x00\x00\x00'
@@ -1,15 +1,16 @@
 import yaml
 import os
-import numpy
+import math
 import uuid
 import sys
 import typing
 import cbor2
 import io
+import struct
 import dataclasses
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class EncodeConfig:
     # Encode CBOR canonically (order map entries)
     canonical: bool = True
@@ -17,6 +18,9 @@ class EncodeConfig:
     # Encode using indefinite containers
     indefinite_containers: bool = True
 
+    # Number fields that are always encoded in the same width (as 4 B floats), so that they can be updated in place
+    stable_width_fields: frozenset[str] = frozenset()
+
 
 # Without this bit of magic, the cbor2 Python library encodes some floats (for example 0.3) as 8 B doubles - we don't want that, it wastes space
 class CompactFloat:
@@ -31,16 +35,315 @@ class CompactFloat:
         if num.is_integer():
             self.value = int(num)
 
-        elif abs(num - numpy.float16(num)) < CompactFloat.required_precision:
-            self.value = float(numpy.float16(num))
+        elif (half := _round_trip(_float16, num)) is not None and abs(num - half) < CompactFloat.required_precision:
+            self.value = half
 
-        elif abs(num - numpy.float32(num)) < CompactFloat.required_precision:
-            self.value = float(numpy.float32(num))
+        elif (single := _round_trip(_float32, num)) is not None and abs(num - single) < CompactFloat.required_precision:
+            self.value = single
 
         else:
             self.value = num
 
 
+_float16 = struct.Struct(">e")
+_float32 = struct.Struct(">f")
+
+
+# Rounds the number to the struct's float format, None if it doesn't fit
+def _round_trip(fmt: struct.Struct, num: float) -> float | None:
+    try:
+        return fmt.unpack(fmt.pack(num))[0]
+    except OverflowError:
+        return None
+
+
+# Stable-width float - always encoded as a 4 B float, so its encoded length doesn't depend on the value
+class StableFloat:
+    value: float
+
+    def __init__(self, num: float):
+        self.value = float(num)
+
+    def encoded(self) -> bytes:
+        return _float32_head.pack(0xFA, self.value)
+
+
+_float32_head = struct.Struct(">Bf")
+
+
+# Returns the offset right after the CBOR data item starting at pos
+def cbor_item_end(data: memoryview, pos: int) -> int:
+    initial_byte = data[pos]
+    major_type = initial_byte >> 5
+    additional_info = initial_byte & 0x1F
+    pos += 1
+
+    if additional_info == 31:
+        # Indefinite-length container or string - ends with the break byte
+        assert major_type in (2, 3, 4, 5), f"Unexpected indefinite length for major type {major_type}"
+        while data[pos] != 0xFF:
+            pos = cbor_item_end(data, pos)
+
+        return pos + 1
+
+    if additional_info < 24:
+        argument = additional_info
+    else:
+        assert additional_info <= 27, f"Invalid CBOR additional information {additional_info}"
+        argument_size = 1 << (additional_info - 24)
+        argument = int.from_bytes(data[pos : pos + argument_size], "big")
+        pos += argument_size
+
+    match major_type:
+        case 2 | 3:
+            # Byte & text strings
+            return pos + argument
+
+        case 4:
+            for _ in range(argument):
+                pos = cbor_item_end(data, pos)
+            return pos
+
+        case 5:
+            for _ in range(argument * 2):
+                pos = cbor_item_end(data, pos)
+            return pos
+
+        case 6:
+            # Tag followed by the tagged item
+            return cbor_item_end(data, pos)
+
+        case _:
+            # Integers and simple values/floats - the argument bytes are the value itself
+            return pos
+
+
+# Locates the encoded values of a top-level CBOR map, returns {key: (value offset, value end)}
+def cbor_map_value_spans(data: memoryview) -> dict[any, tuple[int, int]]:
+    initial_byte = data[0]
+    assert initial_byte >> 5 == 5, "Not a CBOR map"
+
+    additional_info = initial_byte & 0x1F
+    indefinite = additional_info == 31
+    if indefinite:
+        count = None
+        pos = 1
+    elif additional_info < 24:
+        count = additional_info
+        pos = 1
+    else:
+        argument_size = 1 << (additional_info - 24)
+        count = int.from_bytes(data[1 : 1 + argument_size], "big")
+        pos = 1 + argument_size
+
+    result = dict()
+    while (data[pos] != 0xFF) if indefinite else (len(result) < count):
+        key_end = cbor_item_end(data, pos)
+        key = cbor2.loads(data[pos:key_end])
+        value_end = cbor_item_end(data, key_end)
+        result[key] = (key_end, value_end)
+        pos = value_end
+
+    return result
+
+
+# Encodes a CBOR data item head (major type + argument) in the shortest form
+def cbor_head(major_type: int, argument: int) -> bytes:
+    major_type <<= 5
+    if argument < 24:
+        return bytes((major_type | argument,))
+    elif argument < 0x100:
+        return bytes((major_type | 24, argument))
+    elif argument < 0x10000:
+        return _head16.pack(major_type | 25, argument)
+    elif argument < 0x100000000:
+        return _head32.pack(major_type | 26, argument)
+    else:
+        return _head64.pack(major_type | 27, argument)
+
+
+_uint8_heads = [bytes((argument,)) if argument < 24 else bytes((24, argument)) for argument in range(0x100)]
+_head16 = struct.Struct(">BH")
+_head32 = struct.Struct(">BL")
+_head64 = struct.Struct(">BQ")
+_half_head = struct.Struct(">Be")
+_double_head = struct.Struct(">Bd")
+
+
+# Shortest float encoding that doesn't lose precision - same as canonical cbor2
+def cbor_minimal_float(value: float) -> bytes:
+    if math.isnan(value):
+        return b"\xf9\x7e\x00"
+
+    elif math.isinf(value):
+        return b"\xf9\x7c\x00" if value > 0 else b"\xf9\xfc\x00"
+
+    for fmt, head in ((_half_head, 0xF9), (_float32_head, 0xFA)):
+        # The cbor2 C extension never uses half floats with the highest exponent, do the same to stay byte-identical
+        if head == 0xF9 and abs(value) >= 32768:
+            continue
+
+        try:
+            encoded = fmt.pack(head, value)
+        except OverflowError:
+            continue
+
+        if fmt.unpack(encoded)[1] == value:
+            return encoded
+
+    return _double_head.pack(0xFB, value)
+
+
+class _NotCompilable(Exception):
+    pass
+
+
+class FieldsEncoder:
+    """CBOR map encoder specialized for a Fields schema.
+
+    Key heads and their canonical order are precomputed, values are encoded directly into a single buffer.
+    The output is byte-identical to encode_generic; encode returns None for data it can't handle (e.g. nested maps in unknown fields).
+    """
+
+    # key -> encoded key head
+    key_heads: dict[int, bytes]
+
+    # key -> canonical sort key
+    key_order: dict[int, tuple[int, bytes]]
+
+    def __init__(self, keys: typing.Iterable[int]):
+        self.key_heads = {key: self._encode_key(key) for key in keys}
+        self.key_order = {key: (len(head), head) for key, head in self.key_heads.items()}
+
+    @staticmethod
+    def _encode_key(key) -> bytes:
+        if type(key) is not int or not (-0x10000000000000000 <= key < 0x10000000000000000):
+            raise _NotCompilable()
+
+        return cbor_head(0, key) if key >= 0 else cbor_head(1, -(key + 1))
+
+    def encode(self, data: dict[int, any], config: EncodeConfig) -> bytes | None:
+        try:
+            out = bytearray()
+            self._encode_map(out, data, config)
+            return bytes(out)
+
+        except _NotCompilable:
+            return None
+
+    def _encode_map(self, out: bytearray, data: dict[int, any], config: EncodeConfig):
+        key_heads = self.key_heads
+
+        keys = data.keys()
+        if config.canonical:
+            try:
+                keys = sorted(keys, key=self.key_order.__getitem__)
+            except KeyError:
+                # Keys outside of the schema
+                keys = sorted(keys, key=self._sort_key)
+
+        if config.indefinite_containers:
+            out.append(0xBF)
+        else:
+            out += cbor_head(5, len(data))
+
+        encode_value = self._encode_value
+        for key in keys:
+            head = key_heads.get(key)
+            out += head if head is not None else self._encode_key(key)
+            encode_value(out, data[key], config)
+
+        if config.indefinite_containers:
+            out.append(0xFF)
+
+    def _sort_key(self, key) -> tuple[int, bytes]:
+        head = self.key_heads.get(key) or self._encode_key(key)
+        return (len(head), head)
+
+    def _encode_value(self, out: bytearray, value: any, config: EncodeConfig):
+        value_type = type(value)
+
+        if value_type is CompactFloat:
+            # Always encoded canonically
+            value = value.value
+            value_type = type(value)
+            if value_type is float:
+                out += cbor_minimal_float(value)
+                return
+
+        if value_type is int:
+            if 0 <= value < 0x100:
+                out += _uint8_heads[value]
+            else:
+                self._encode_int(out, value)
+
+        elif value_type is StableFloat:
+            out += value.encoded()
+
+        elif value_type is bool:
+            out.append(0xF5 if value else 0xF4)
+
+        elif value_type is str:
+            encoded = value.encode("utf-8")
+            out += cbor_head(3, len(encoded))
+            out += encoded
+
+        elif value_type is bytes or value_type is bytearray:
+            out += cbor_head(2, len(value))
+            out += value
+
+        elif value_type is list or value_type is tuple:
+            if config.indefinite_containers:
+                out.append(0x9F)
+            else:
+                out += cbor_head(4, len(value))
+
+            for item in value:
+                self._encode_value(out, item, config)
+
+            if config.indefinite_containers:
+                out.append(0xFF)
+
+        elif value_type is float:
+            # Non-canonically, only the special values get the short encoding
+            out += cbor_minimal_float(value) if config.canonical or not math.isfinite(value) else _double_head.pack(0xFB, value)
+
+        else:
+            raise _NotCompilable()
+
+    @staticmethod
+    def _encode_int(out: bytearray, value: int):
+        if value >= 0x10000000000000000 or value < -0x10000000000000000:
+            # Big integers are encoded as tagged byte strings
+            raise _NotCompilable()
+
+        out += cbor_head(0, value) if value >= 0 else cbor_head(1, -(value + 1))
+
+
+# Encodes the map using the generic cbor2 encoder
+def encode_generic(data: dict[any, any], config: EncodeConfig) -> bytes:
+    def default_enc(enc: cbor2.CBOREncoder, data: typing.Any):
+        if isinstance(data, CompactFloat):
+            # Always encode floats canonically
+            # Noncanonically, floats would always be encoded in 8 B, which is a lot of wasted space
+            cbor2.CBOREncoder(enc.fp, canonical=True).encode(data.value)
+        elif isinstance(data, StableFloat):
+            enc.fp.write(data.encoded())
+        else:
+            raise RuntimeError(f"Unsupported type {type(data)} to encode")
+
+    data_io = io.BytesIO()
+    encoder = cbor2.CBOREncoder(
+        data_io,
+        canonical=config.canonical,
+        indefinite_containers=config.indefinite_containers,
+        default=default_enc,
+    )
+
+    encoder.encode(data)
+    return data_io.getvalue()
+
+
 class Field:
     key: int
     name: str
@@ -98,6 +401,8 @@ class EnumFieldBase(Field):
     items_by_key: dict[str, int]
     items_by_name: dict[int, str]
     items_yaml: list[dict]
+    items_file: str
+    items_table: tuple[str | None, ...] | None
 
     def __init__(self, config, config_dir):
         super().__init__(config, config_dir)
@@ -105,7 +410,8 @@ class EnumFieldBase(Field):
         self.items_by_key = dict()
         self.items_by_name = dict()
 
-        self.items_yaml = yaml.safe_load(open(os.path.join(config_dir, config["items_file"]), "r", encoding="utf-8"))
+        self.items_file = os.path.join(config_dir, config["items_file"])
+        self.items_yaml = yaml.safe_load(open(self.items_file, "r", encoding="utf-8"))
         for item in self.items_yaml:
             if item.get("deprecated", False):
                 continue
@@ -119,13 +425,29 @@ class EnumFieldBase(Field):
             self.items_by_key[key] = name
             self.items_by_name[name] = key
 
+        # Enum keys are small and dense, so decoding can index a tuple instead of looking up the dict
+        if len(self.items_by_key) and min(self.items_by_key) >= 0 and max(self.items_by_key) < 4 * len(self.items_by_key) + 64:
+            self.items_table = tuple(self.items_by_key.get(key) for key in range(max(self.items_by_key) + 1))
+        else:
+            self.items_table = None
+
+    def lookup(self, key) -> str:
+        table = self.items_table
+        if table is not None and type(key) is int and 0 <= key < len(table):
+            name = table[key]
+            if name is not None:
+                return name
+
+        # Raises the KeyError for unknown keys
+        return self.items_by_key[key]
+
 
 class EnumField(EnumFieldBase):
     def __init__(self, config, config_dir):
         super().__init__(config, config_dir)
 
     def decode(self, data):
-        return self.items_by_key[data]
+        return self.lookup(data)
 
     def encode(self, data):
         return self.items_by_name[data]
@@ -141,11 +463,18 @@ class EnumArrayField(EnumFieldBase):
     def decode(self, data):
         assert type(data) is list
 
-        result = []
-        for item in data:
-            result.append(self.items_by_key[item])
+        table = self.items_table
+        if table is not None:
+            try:
+                result = [table[item] for item in data]
+            except (IndexError, TypeError):
+                result = None
 
-        return result
+            # Negative indices would wrap around, gaps in the table are None
+            if result is not None and None not in result and (len(data) == 0 or min(data) >= 0):
+                return result
+
+        return [self.lookup(item) for item in data]
 
     def encode(self, data):
         assert type(data) is list
@@ -228,10 +557,21 @@ class Fields:
     fields_by_key: dict[int, Field]
     fields_by_name: dict[str, Field]
 
+    # YAML files the fields were loaded from (including enum item files)
+    source_files: list[str]
+
+    encoder: FieldsEncoder
+
+    # key -> (field name, value decoder)
+    decoders: dict[int, tuple[str, typing.Callable[[any], any]]]
+
     def __init__(self):
         self.fields_by_key = dict()
         self.fields_by_name = dict()
         self.required_fields = list()
+        self.source_files = list()
+        self.encoder = FieldsEncoder(())
+        self.decoders = dict()
 
     def init_from_yaml(self, yaml, config_dir):
         for row in yaml:
@@ -251,8 +591,15 @@ class Fields:
             self.fields_by_key[field.key] = field
             self.fields_by_name[field.name] = field
 
+            if isinstance(field, EnumFieldBase):
+                self.source_files.append(field.items_file)
+
+        self.encoder = FieldsEncoder(self.fields_by_key.keys())
+        self.decoders = {key: (field.name, field.decode) for key, field in self.fields_by_key.items()}
+
     def from_file(file: str):
         r = Fields()
+        r.source_files.append(file)
         r.init_from_yaml(yaml.safe_load(open(file, "r", encoding="utf-8")), os.path.dirname(file))
 
         return r
@@ -260,22 +607,30 @@ class Fields:
     # Decodes the fields and values from the CBOR binary data
     # If out_unknown_fields is provided, unknown fields are written into it instead of asserting
     def decode(self, binary_data: typing.IO[bytes], out_unknown_fields: dict[any, any] = None):
-        data = cbor2.load(binary_data)
+        return self.decode_map(cbor2.load(binary_data), out_unknown_fields=out_unknown_fields)
+
+    # Same as decode, but for an already CBOR-decoded map
+    def decode_map(self, data: dict[any, any], out_unknown_fields: dict[any, any] = None):
+        decoders = self.decoders
         result = dict()
-        for key, value in data.items():
-            field = self.fields_by_key.get(key)
 
-            if field is None and out_unknown_fields is not None:
-                out_unknown_fields[key] = value
-                continue
+        key = None
+        try:
+            for key, value in data.items():
+                decoder = decoders.get(key)
 
-            assert field, f"Unknown CBOR key '{key}'"
+                if decoder is None:
+                    assert out_unknown_fields is not None, f"Unknown CBOR key '{key}'"
+                    out_unknown_fields[key] = value
+                    continue
 
-            try:
-                result[field.name] = field.decode(value)
-            except Exception as e:
+                name, decode = decoder
+                result[name] = decode(value)
+
+        except Exception as e:
+            if (field := self.fields_by_key.get(key)) is not None:
                 e.add_note(f"Field {key} {field.name}")
-                raise
+            raise
 
         return result
 
@@ -283,8 +638,11 @@ class Fields:
     def encode(self, data: dict[str, any], config: EncodeConfig = EncodeConfig()) -> bytes:
         return self.update(update_fields=data, config=config)
 
-    def update(self, original_data: typing.IO[bytes] = None, update_fields: dict[str, any] = {}, remove_fields: list[str] = [], config: EncodeConfig = EncodeConfig()) -> bytes:
-        if original_data:
+    # The original data can be passed either as CBOR binary data or as an already decoded map (which gets modified)
+    def update(self, original_data: typing.IO[bytes] = None, update_fields: dict[str, any] = {}, remove_fields: list[str] = [], config: EncodeConfig = EncodeConfig(), original_map: dict[any, any] = None) -> bytes:
+        if original_map is not None:
+            result = original_map
+        elif original_data:
             result = cbor2.load(original_data)
         else:
             result = dict()
@@ -295,39 +653,75 @@ class Fields:
 
             del result[field.key]
 
+        stable_width_keys = self._stable_width_keys(config)
+
         for field_name, value in update_fields.items():
             field = self.fields_by_name.get(field_name)
             assert field, f"Unknown field '{field_name}'"
 
             try:
-                result[field.key] = field.encode(value)
+                result[field.key] = StableFloat(value) if field.key in stable_width_keys else field.encode(value)
             except Exception as e:
                 e.add_note(f"Field {field.key} {field.name}")
                 raise
 
         # Enforce use of CompactFloat, the "default" float encoding is not optimal when canonical == False
         for field_name, value in result.copy().items():
-            if isinstance(value, float):
+            if field_name in stable_width_keys and isinstance(value, (int, float)):
+                result[field_name] = StableFloat(value)
+            elif isinstance(value, float):
                 result[field_name] = CompactFloat(value)
 
-        def default_enc(enc: cbor2.CBOREncoder, data: typing.Any):
-            if isinstance(data, CompactFloat):
-                # Always encode floats canonically
-                # Noncanonically, floats would always be encoded in 8 B, which is a lot of wasted space
-                cbor2.CBOREncoder(enc.fp, canonical=True).encode(data.value)
-            else:
-                raise RuntimeError(f"Unsupported type {type(data)} to encode")
-
-        data_io = io.BytesIO()
-        encoder = cbor2.CBOREncoder(
-            data_io,
-            canonical=config.canonical,
-            indefinite_containers=config.indefinite_containers,
-            default=default_enc,
-        )
-
-        encoder.encode(result)
-        return data_io.getvalue()
+        encoded = self.encoder.encode(result, config)
+        if encoded is None:
+            # Data the compiled encoder doesn't support (can come from unknown fields)
+            encoded = encode_generic(result, config)
+
+        return encoded
+
+    def _stable_width_keys(self, config: EncodeConfig) -> set[int]:
+        result = set()
+        for field_name in config.stable_width_fields:
+            field = self.fields_by_name.get(field_name)
+            if field is None:
+                # Stable width fields are configured for all regions, the field might belong to a different one
+                continue
+
+            assert isinstance(field, NumberField), f"Stable width is only supported for number fields, not '{field_name}'"
+            result.add(field.key)
+
+        return result
+
+    # Tries to update stable width fields directly in the encoded data, without re-encoding the map
+    # Returns a list of (offset, encoded value) writes, or None if the update can't be done in place
+    def update_in_place(self, encoded_data: memoryview, update_fields: dict[str, any], config: EncodeConfig) -> list[tuple[int, bytes]] | None:
+        stable_width_keys = self._stable_width_keys(config)
+        if len(update_fields) == 0 or len(stable_width_keys) == 0:
+            return None
+
+        value_spans = None
+        result = list()
+
+        for field_name, value in update_fields.items():
+            field = self.fields_by_name.get(field_name)
+            assert field, f"Unknown field '{field_name}'"
+
+            if field.key not in stable_width_keys:
+                return None
+
+            if value_spans is None:
+                value_spans = cbor_map_value_spans(encoded_data)
+
+            span = value_spans.get(field.key)
+            encoded = StableFloat(value).encoded()
+
+            # The field has to be already present and stored in the stable width
+            if span is None or span[1] - span[0] != len(encoded) or encoded_data[span[0]] != encoded[0]:
+                return None
+
+            result.append((span[0], encoded))
+
+        return result
 
     def validate(self, decoded_data):
         for field_name, field in self.fields_by_name.items():
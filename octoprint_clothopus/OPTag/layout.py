@@ -0,0 +1,137 @@
+"""Plans where the aux region goes on a new tag, by simulating the typical updates of its hot fields.
+
+Only the aux region is planned. Meta and main keep the fixed layout of nfc_initialize. Both are written once when the tag
+is initialized and never touched by the polls, so their placement doesn't change the block writes of an update. The
+main region simply takes the space between the meta region and the planned aux region.
+"""
+import dataclasses
+
+from ..OPTag.fields import Fields, Field, EncodeConfig, NumberField, IntField, BoolField, StringField, BytesField, EnumField, EnumArrayField, UUIDField
+from ..OPTag.record import Record, Region
+
+# Typical values used to simulate updates of the aux region
+_TYPICAL_NUMBER = 123.4
+_TYPICAL_NUMBER_UPDATE = 125.7
+
+# Size of a single appended item of a growing bytes field (e.g. one clotho_weight_history record)
+_APPEND_SIZE = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class LayoutPlan:
+    aux_region_offset: int  # Relative to the NDEF payload start
+    aux_region_size: int
+
+    # Update pattern name -> number of blocks rewritten by a single such update
+    update_costs: dict[str, int]
+
+
+class _ScratchRecord:
+    """Just enough of a Record to simulate region updates on a scratch buffer"""
+
+    mark_changed = Record.mark_changed
+
+    def __init__(self, payload_offset: int, block_size: int, encode_config: EncodeConfig):
+        self.payload_offset = payload_offset
+        self.block_size = block_size
+        self.encode_config = encode_config
+        self.dirty_blocks = set()
+
+
+def _encoded_uint_size(value: int) -> int:
+    if value < 24:
+        return 1
+    elif value < 0x100:
+        return 2
+    elif value < 0x10000:
+        return 3
+    elif value < 0x100000000:
+        return 5
+    else:
+        return 9
+
+
+def max_encoded_size(field: Field, config: EncodeConfig) -> int:
+    """Upper estimate of how many bytes the field (key and value) takes in an encoded map"""
+
+    key_size = _encoded_uint_size(field.key)
+
+    if isinstance(field, NumberField):
+        value_size = 5 if field.name in config.stable_width_fields else 9
+    elif isinstance(field, (IntField, EnumField)):
+        value_size = 9
+    elif isinstance(field, BoolField):
+        value_size = 1
+    elif isinstance(field, EnumArrayField):
+        value_size = _encoded_uint_size(field.max_len) + field.max_len * _encoded_uint_size(max(field.items_by_key))
+    elif isinstance(field, (StringField, BytesField)):
+        value_size = _encoded_uint_size(field.max_len) + field.max_len
+    elif isinstance(field, UUIDField):
+        value_size = 17
+    else:
+        assert False, f"Unknown field type {type(field)}"
+
+    return key_size + value_size
+
+
+def _typical_values(fields: Fields, field_names: list[str]) -> tuple[dict[str, any], dict[str, dict[str, any]]]:
+    """Returns (typical region contents, update pattern name -> update) for the hot fields"""
+
+    contents = dict()
+    updates = dict()
+
+    for name in field_names:
+        field = fields.fields_by_name[name]
+
+        if isinstance(field, NumberField):
+            contents[name] = _TYPICAL_NUMBER
+            updates[name] = {name: _TYPICAL_NUMBER_UPDATE}
+
+        elif isinstance(field, BytesField):
+            # Half-full growing field, typical update appends one item
+            filled = (field.max_len // 2) // _APPEND_SIZE * _APPEND_SIZE
+            contents[name] = bytes(filled)
+            updates[f"{name}_append"] = {name: bytes(filled) + bytes([0xFF] * _APPEND_SIZE)}
+
+    return contents, updates
+
+
+def simulate_update_costs(fields: Fields, field_names: list[str], region_absolute_offset: int, region_size: int, block_size: int, config: EncodeConfig) -> dict[str, int]:
+    """Returns the number of blocks a typical update of each of the hot fields rewrites, for a region at the given absolute offset"""
+
+    contents, updates = _typical_values(fields, field_names)
+    result = dict()
+
+    for pattern, update in updates.items():
+        record = _ScratchRecord(region_absolute_offset, block_size, config)
+        region = Region(record, 0, memoryview(bytearray(region_size)), fields)
+        region.write(contents)
+        record.dirty_blocks.clear()
+
+        # Mirror the typical poll - hot fields are updated on their own
+        region.update(update)
+        result[pattern] = len(record.dirty_blocks)
+
+    return result
+
+
+def plan_aux_region(fields: Fields, hot_fields: list[str], payload_start: int, payload_size: int, block_size: int, config: EncodeConfig, min_size: int = 0) -> LayoutPlan:
+    """Places the aux region at the payload tail so that it fits the hot fields and their typical updates rewrite as few blocks as possible"""
+
+    hot_fields = [name for name in hot_fields if name in fields.fields_by_name]
+
+    # Map header & indefinite container break
+    needed_size = 2 + sum(max_encoded_size(fields.fields_by_name[name], config) for name in hot_fields)
+    needed_size = max(needed_size, min_size)
+
+    best = None
+    # The cost only depends on the offset modulo the block size - try all possible misalignments, preferring the offset that leaves the most space to the main region
+    for shift in range(block_size):
+        offset = payload_size - needed_size - shift
+        costs = simulate_update_costs(fields, hot_fields, payload_start + offset, payload_size - offset, block_size, config)
+        total_cost = sum(costs.values())
+
+        if best is None or total_cost < best[0]:
+            best = (total_cost, LayoutPlan(aux_region_offset=offset, aux_region_size=payload_size - offset, update_costs=costs))
+
+    return best[1]
@@ -0,0 +1,135 @@
+import ndef
+import struct
+import typing
+
+# TLV block tags (NFC Forum Type 5 Tag)
+TLV_NULL = 0x00
+TLV_NDEF = 0x03
+TLV_TERMINATOR = 0xFE
+
+# NDEF record header flags
+NDEF_FLAG_MB = 0x80
+NDEF_FLAG_ME = 0x40
+NDEF_FLAG_CF = 0x20
+NDEF_FLAG_SR = 0x10
+NDEF_FLAG_IL = 0x08
+NDEF_TNF_MASK = 0x07
+
+NDEF_TNF_MEDIA_TYPE = 0x02
+
+_uint16 = struct.Struct(">H")
+_uint32 = struct.Struct(">I")
+
+
+class NdefRecordLocation(typing.NamedTuple):
+    """Position of a single NDEF record within the tag image - all offsets are absolute"""
+
+    flags: int
+    tnf: int
+    offset: int  # Start of the record header
+    type_offset: int
+    type_length: int
+    payload_offset: int
+    payload_length: int
+
+    @property
+    def end(self) -> int:
+        return self.payload_offset + self.payload_length
+
+
+def find_ndef_message(data: memoryview) -> tuple[int, int]:
+    """Walks the capability container and the TLV chain, returns (offset, length) of the NDEF message.
+
+    Works directly on the memoryview, nothing is copied.
+    """
+
+    data_len = len(data)
+    assert data_len >= 4, "Data too short to contain the capability container"
+
+    # TODO: Support 8-byte CC (with a different magic)
+    assert data[0] == 0xE1, "Capability container magic number does not match"
+
+    pos = 4
+    while pos < data_len:
+        tag = data[pos]
+
+        # Null TLVs consist only of the tag byte
+        if tag == TLV_NULL:
+            pos += 1
+            continue
+
+        assert tag != TLV_TERMINATOR, "Did not find NDEF TLV"
+        assert pos + 2 <= data_len, "TLV header out of range"
+
+        tlv_len = data[pos + 1]
+        pos += 2
+
+        # 0xFF means that length takes two bytes
+        if tlv_len == 0xFF:
+            assert pos + 2 <= data_len, "TLV extended length out of range"
+            tlv_len = _uint16.unpack_from(data, pos)[0]
+            pos += 2
+
+        if tag == TLV_NDEF:
+            assert pos + tlv_len <= data_len, "NDEF TLV exceeds the data"
+            return pos, tlv_len
+
+        # Skip the TLV block
+        pos += tlv_len
+
+    assert False, "Did not find NDEF TLV"
+
+
+def iter_ndef_records(data: memoryview, offset: int, end: int) -> typing.Iterator[NdefRecordLocation]:
+    """Parses NDEF record headers (both short and long) in data[offset:end] without decoding the records"""
+
+    pos = offset
+    while pos < end:
+        record_offset = pos
+        flags = data[pos]
+        type_length = data[pos + 1]
+        pos += 2
+
+        if flags & NDEF_FLAG_SR:
+            payload_length = data[pos]
+            pos += 1
+        else:
+            payload_length = _uint32.unpack_from(data, pos)[0]
+            pos += 4
+
+        if flags & NDEF_FLAG_IL:
+            id_length = data[pos]
+            pos += 1
+        else:
+            id_length = 0
+
+        type_offset = pos
+        payload_offset = type_offset + type_length + id_length
+        assert payload_offset + payload_length <= end, "NDEF record exceeds the NDEF message"
+
+        location = NdefRecordLocation(
+            flags=flags,
+            tnf=flags & NDEF_TNF_MASK,
+            offset=record_offset,
+            type_offset=type_offset,
+            type_length=type_length,
+            payload_offset=payload_offset,
+            payload_length=payload_length,
+        )
+        yield location
+
+        if flags & NDEF_FLAG_ME:
+            return
+
+        pos = location.end
+
+
+def is_media_record(data: memoryview, location: NdefRecordLocation, mime_type: bytes) -> bool:
+    return location.tnf == NDEF_TNF_MEDIA_TYPE and data[location.type_offset : location.type_offset + location.type_length] == mime_type
+
+
+def decode_ndef_record(data: memoryview, location: NdefRecordLocation):
+    """Fully decodes a single record using the ndef library - meant for the (small) non-openprinttag records"""
+
+    # The record is taken out of its message, so the MB/ME flags don't need to be consistent
+    return next(ndef.message_decoder(bytes(data[location.offset : location.end]), errors="relax"), None)
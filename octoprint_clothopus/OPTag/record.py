@@ -1,12 +1,12 @@
-import os
 import ndef
-import yaml
 import cbor2
 import io
 import types
 import typing
 
 from ..OPTag.fields import Fields, EncodeConfig
+from ..OPTag.schema import Schema, get_schema
+from ..OPTag.ndef_locator import NdefRecordLocation, find_ndef_message, iter_ndef_records, is_media_record, decode_ndef_record
 
 
 class Region:
@@ -14,7 +14,14 @@ class Region:
     offset: int  # Offset of the region relative to payload start
     fields: Fields
     record: typing.Any
-    is_corrupt: bool = False
+
+    # Decoding results, valid until the region memory is written by update()
+    _raw: tuple[typing.Any, int] | None = None  # (decoded CBOR map, used size)
+    _read: tuple[dict[str, any], dict[any, any]] | None = None  # (decoded fields, unknown fields)
+    _forced_corrupt: bool = False
+
+    # Marker for regions whose CBOR couldn't be decoded
+    _CORRUPT = (None, 0)
 
     def __init__(self, record, offset: int, memory: memoryview, fields: Fields):
         assert type(memory) is memoryview
@@ -25,13 +32,31 @@ class Region:
         self.memory = memory
         self.fields = fields
 
-        try:
-            cbor2.load(io.BytesIO(self.memory))
-        except cbor2.CBORError:
-            self.is_corrupt = True
-
         if len(self.memory) == 0:
-            self.is_corrupt = True
+            self._forced_corrupt = True
+
+    @property
+    def is_corrupt(self) -> bool:
+        return self._forced_corrupt or self._decode_raw() is Region._CORRUPT
+
+    @is_corrupt.setter
+    def is_corrupt(self, value: bool):
+        self._forced_corrupt = value
+
+    def _decode_raw(self):
+        """Decodes the region CBOR in a single pass, caching the decoded map together with its encoded length"""
+        if self._raw is None:
+            data_io = io.BytesIO(self.memory)
+            try:
+                self._raw = (cbor2.load(data_io), data_io.tell())
+            except cbor2.CBORError:
+                self._raw = Region._CORRUPT
+
+        return self._raw
+
+    def _invalidate(self):
+        self._raw = None
+        self._read = None
 
     def info_dict(self):
         result = {
@@ -50,15 +75,25 @@ class Region:
         if self.is_corrupt:
             return 0
 
-        data_io = io.BytesIO(self.memory)
-        cbor2.load(data_io)
-        return data_io.tell()
+        return self._decode_raw()[1]
 
     def read(self, out_unknown_fields: dict[any, any] = None) -> dict[str, any]:
         if self.is_corrupt:
             return {}
 
-        return self.fields.decode(io.BytesIO(self.memory), out_unknown_fields=out_unknown_fields)
+        if self._read is None:
+            unknown_fields = dict()
+            self._read = (self.fields.decode_map(self._decode_raw()[0], out_unknown_fields=unknown_fields), unknown_fields)
+
+        result, unknown_fields = self._read
+
+        if out_unknown_fields is not None:
+            out_unknown_fields.update(unknown_fields)
+        else:
+            assert len(unknown_fields) == 0, f"Unknown CBOR key '{next(iter(unknown_fields))}'"
+
+        # Shallow copy so that callers can't modify the cached result
+        return dict(result)
 
     def write(self, data: dict[str, any]):
         return self.update(data, clear=True)
@@ -67,14 +102,36 @@ class Region:
         if len(update_fields) == 0 and len(remove_fields) == 0 and not clear:
             # Nothing to do
             return
-        encoded = self.fields.update(original_data=io.BytesIO(self.memory) if not clear else None, update_fields=update_fields, remove_fields=remove_fields, config=self.record.encode_config)
+
+        if clear:
+            original_map = None
+        else:
+            raw = self._decode_raw()
+            assert raw is not Region._CORRUPT, "Cannot update a corrupt region"
+            original_map = dict(raw[0])
+
+            # Stable width fields can be overwritten directly, without shifting the rest of the region
+            in_place_writes = None if len(remove_fields) else self.fields.update_in_place(self.memory, update_fields, self.record.encode_config)
+            if in_place_writes is not None:
+                for offset, encoded in in_place_writes:
+                    self.record.mark_changed(self.record.payload_offset + self.offset + offset, self.memory[offset : offset + len(encoded)], encoded)
+                    self.memory[offset : offset + len(encoded)] = encoded
+
+                self._invalidate()
+                return raw[1]
+
+        encoded = self.fields.update(original_map=original_map, update_fields=update_fields, remove_fields=remove_fields, config=self.record.encode_config)
         encoded_len = len(encoded)
 
         assert encoded_len <= len(self.memory), f"Data of size {encoded_len} does not fit into region of size {len(self.memory)}"
 
-        # Write zeroes to the whole region
-        self.memory[:] = bytearray(len(self.memory))
-        self.memory[0:encoded_len] = encoded
+        # The rest of the region is zero-filled
+        new_memory = bytearray(len(self.memory))
+        new_memory[0:encoded_len] = encoded
+
+        self.record.mark_changed(self.record.payload_offset + self.offset, self.memory, new_memory)
+        self.memory[:] = new_memory
+        self._invalidate()
         return encoded_len
 
 
@@ -82,27 +139,38 @@ class Record:
     data: memoryview
     payload: memoryview
     payload_offset: int  # Offset of the payload relative to the NDEF message start
+    schema: Schema
     config: types.SimpleNamespace
     config_dir: str
-    uri: str = None
+    _uri: str = None
+    _preceding_records: list[NdefRecordLocation]
 
-    meta_region: Region = None
-    main_region: Region = None
-    aux_region: Region = None
+    encode_config: EncodeConfig
 
-    regions: dict[str, Region] = None
+    # Region name -> (offset, size, fields), determined from the meta section only
+    _layout: dict[str, tuple[int, int | None, Fields]] = None
+    _meta_raw: tuple[typing.Any, int] = None
 
-    encode_config: EncodeConfig
+    # Regions are only created when first accessed
+    _regions: dict[str, Region]
 
-    def __init__(self, config_file: str, data: memoryview):
+    # Indices of block_size blocks of data that were changed since the last sync
+    block_size: int
+    dirty_blocks: set[int]
+
+    def __init__(self, config_file: str, data: memoryview, block_size: int = 4, encode_config: EncodeConfig = None):
         assert type(data) is memoryview
 
         self.data = data
-        self.encode_config = EncodeConfig()
+        self.block_size = block_size
+        self.dirty_blocks = set()
+        self.encode_config = encode_config or EncodeConfig()
+        self._regions = dict()
+        self._preceding_records = list()
 
-        self.config_dir = os.path.dirname(config_file)
-        with open(config_file, "r", encoding="utf-8") as f:
-            self.config = types.SimpleNamespace(**yaml.safe_load(f))
+        self.schema = get_schema(config_file)
+        self.config = self.schema.config
+        self.config_dir = self.schema.config_dir
 
         # Decode the root and find payload
         match self.config.root:
@@ -111,49 +179,19 @@ class Record:
                 self.payload_offset = 0
 
             case "nfcv":
-                data_io = io.BytesIO(data)
-                cc = data_io.read(4)
-
-                # TODO: Support 8-byte CC (with a different magic)
-                assert cc[0] == 0xE1, "Capability container magic number does not match"
-
-                # Find the NDEF TLV
-                while True:
-                    base_tlv = data_io.read(2)
-                    tag = base_tlv[0]
+                message_offset, message_length = find_ndef_message(data)
+                mime_type = self.config.mime_type.encode()
 
-                    # Either gone out of range or hit a terminator TLV
-                    if (tag is None) or (tag == 0xFE):
-                        assert base_tlv is not None, "Did not found NDEF TLV"
-
-                    tlv_len = base_tlv[1]
-
-                    # 0xFF means that length takes two bytes
-                    if tlv_len == 0xFF:
-                        ext_len = data_io.read(2)
-                        assert ext_len is not None
-                        tlv_len = ext_len[0] * 256 | ext_len[1]
-
-                    # 0x03 = NDEF TLV
-                    if tag == 0x03:
-                        # Found it -
-                        break
-                    else:
-                        # Skip the TLV block
-                        data_io.seek(tlv_len, 1)
-
-                for record in ndef.message_decoder(data_io):
-                    if type(record) is ndef.UriRecord:
-                        self.uri = record.uri
-
-                    if record.type == self.config.mime_type:
+                for location in iter_ndef_records(data, message_offset, message_offset + message_length):
+                    if is_media_record(data, location, mime_type):
                         # We have to create a sub memoryview so that when we update the region, the outer data updates as well
-                        end = data_io.tell()
-                        self.payload_offset = end - len(record.data)
-                        self.payload = data[self.payload_offset : end]
-                        assert self.payload == record.data
+                        self.payload_offset = location.payload_offset
+                        self.payload = data[location.payload_offset : location.end]
                         break
 
+                    # Other records (typically the URI one) are only decoded when the URI is asked for
+                    self._preceding_records.append(location)
+
                 else:
                     raise Exception(f"Did not find a record of type '{self.config.mime_type}'")
 
@@ -161,19 +199,108 @@ class Record:
                 raise Exception(f"Unknown root type '{self.config.root}'")
 
         assert type(self.payload) is memoryview
-        self._setup_regions()
 
-    def _setup_regions(self):
-        if "meta_fields" not in self.config.__dict__:
+    def mark_changed(self, offset: int, old: memoryview, new: bytes):
+        """Marks blocks that differ between old and new (both starting at absolute offset in data) as dirty"""
+        assert len(old) == len(new)
+
+        block_size = self.block_size
+        end = offset + len(new)
+        for block in range(offset // block_size, (end + block_size - 1) // block_size):
+            start = max(block * block_size, offset) - offset
+            stop = min((block + 1) * block_size, end) - offset
+
+            if old[start:stop] != new[start:stop]:
+                self.dirty_blocks.add(block)
+
+    def block_edits(self) -> list[tuple[int, bytes]]:
+        """Returns (first block index, data) edits covering all dirty blocks, consecutive blocks are merged into a single edit"""
+        edits = list()
+        block_size = self.block_size
+
+        for block in sorted(self.dirty_blocks):
+            if edits and edits[-1][0] + len(edits[-1][1]) // block_size == block:
+                first_block, block_data = edits[-1]
+                edits[-1] = (first_block, block_data + bytes(self.data[block * block_size : (block + 1) * block_size]))
+            else:
+                edits.append((block, bytes(self.data[block * block_size : (block + 1) * block_size])))
+
+        return edits
+
+    def mark_synced(self):
+        """To be called once the data was written to the tag"""
+        self.dirty_blocks.clear()
+
+    @property
+    def uri(self) -> str | None:
+        if self._preceding_records:
+            # Non-openprinttag records are rare and small, leave them to the ndef library
+            for location in self._preceding_records:
+                record = decode_ndef_record(self.data, location)
+                if type(record) is ndef.UriRecord:
+                    self._uri = record.uri
+
+            self._preceding_records.clear()
+
+        return self._uri
+
+    @property
+    def region_names(self) -> list[str]:
+        return list(self._get_layout().keys())
+
+    @property
+    def regions(self) -> dict[str, Region]:
+        return {name: self.get_region(name) for name in self.region_names}
+
+    @property
+    def meta_region(self) -> Region | None:
+        return self.get_region("meta")
+
+    @property
+    def main_region(self) -> Region | None:
+        return self.get_region("main")
+
+    @property
+    def aux_region(self) -> Region | None:
+        return self.get_region("aux")
+
+    def get_region(self, name: str) -> Region | None:
+        """Returns the region of the given name (or None if the record doesn't have it), creating it on first access"""
+        region = self._regions.get(name)
+        if region is not None:
+            return region
+
+        layout = self._get_layout().get(name)
+        if layout is None:
+            return None
+
+        offset, size, fields = layout
+        region = Region(self, offset, self.payload[offset : offset + size], fields)
+
+        if len(region.memory) != size:
+            region.is_corrupt = True
+
+        if name == "meta":
+            # The meta section was already decoded when determining the layout, reuse it instead of decoding it again
+            region._raw = self._meta_raw
+
+        self._regions[name] = region
+        return region
+
+    def _get_layout(self):
+        """Determines region offsets and sizes, decoding only the meta section"""
+        if self._layout is not None:
+            return self._layout
+
+        if self.schema.meta_fields is None:
             # If meta region is not present, we only have the main region which spans the entire payload
-            self.main_region = Region(0, self.payload, Fields.from_file(os.path.join(self.config_dir, self.config.main_fields)))
-            self.regions = {"main", self.main_region}
-            return
+            self._layout = {"main": (0, len(self.payload), self.schema.main_fields)}
+            return self._layout
 
         meta_io = io.BytesIO(self.payload)
-        cbor2.load(meta_io)
+        meta_raw = cbor2.load(meta_io)
         meta_section_size = meta_io.tell()
-        metadata = Region(self, 0, self.payload[0:meta_section_size], Fields.from_file(os.path.join(self.config_dir, self.config.meta_fields))).read()
+        metadata = self.schema.meta_fields.decode_map(meta_raw)
 
         main_region_offset = metadata.get("main_region_offset", meta_section_size)
         main_region_size = metadata.get("main_region_size")
@@ -186,21 +313,20 @@ class Record:
         region_stops = list(filter(lambda x: x is not None, [main_region_offset, aux_region_offset, len(self.payload)]))
         region_stops.sort()
 
-        def create_region(offset, size, fields):
+        def region_layout(offset, size, fields):
             if size is None:
                 size = list(filter(lambda a: a > offset, region_stops))[0] - offset
 
-            result = Region(self, offset, self.payload[offset : offset + size], Fields.from_file(os.path.join(self.config_dir, fields)))
-
-            if len(result.memory) != size:
-                result.is_corrupt = True
+            return (offset, size, fields)
 
-            return result
-
-        self.meta_region = create_region(0, None, self.config.meta_fields)
-        self.main_region = create_region(main_region_offset, main_region_size, self.config.main_fields)
-        self.regions = {"meta": self.meta_region, "main": self.main_region}
+        layout = {
+            "meta": region_layout(0, None, self.schema.meta_fields),
+            "main": region_layout(main_region_offset, main_region_size, self.schema.main_fields),
+        }
 
         if has_aux_region:
-            self.aux_region = create_region(aux_region_offset, aux_region_size, self.config.aux_fields)
-            self.regions["aux"] = self.aux_region
+            layout["aux"] = region_layout(aux_region_offset, aux_region_size, self.schema.aux_fields)
+
+        self._meta_raw = (meta_raw, meta_section_size)
+        self._layout = layout
+        return layout
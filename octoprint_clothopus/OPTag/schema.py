@@ -0,0 +1,95 @@
+import os
+import yaml
+import types
+import threading
+import dataclasses
+
+from ..OPTag.fields import Fields
+
+
+@dataclasses.dataclass(frozen=True)
+class Schema:
+    """Compiled record configuration - the parsed config YAML together with the field definitions it references.
+
+    Instances are shared between all records using the same config file, so they must be treated as read-only.
+    """
+
+    config_file: str
+    config: types.SimpleNamespace
+    config_dir: str
+
+    meta_fields: Fields | None
+    main_fields: Fields
+    aux_fields: Fields | None
+
+    # Modification times of every file the schema was compiled from, used for invalidation
+    source_mtimes: tuple[tuple[str, int], ...]
+
+
+_schema_cache: dict[str, Schema] = dict()
+_schema_cache_lock = threading.Lock()
+
+
+def _mtime(file: str) -> int:
+    return os.stat(file).st_mtime_ns
+
+
+def _is_stale(schema: Schema) -> bool:
+    try:
+        return any(_mtime(file) != mtime for file, mtime in schema.source_mtimes)
+    except OSError:
+        return True
+
+
+def _compile_schema(config_file: str) -> Schema:
+    config_dir = os.path.dirname(config_file)
+    source_files = [config_file]
+
+    with open(config_file, "r", encoding="utf-8") as f:
+        config = types.SimpleNamespace(**yaml.safe_load(f))
+
+    def load_fields(name: str | None):
+        if name is None:
+            return None
+
+        fields = Fields.from_file(os.path.join(config_dir, name))
+        source_files.extend(fields.source_files)
+        return fields
+
+    meta_fields = load_fields(getattr(config, "meta_fields", None))
+    main_fields = load_fields(config.main_fields)
+    aux_fields = load_fields(getattr(config, "aux_fields", None))
+
+    return Schema(
+        config_file=config_file,
+        config=config,
+        config_dir=config_dir,
+        meta_fields=meta_fields,
+        main_fields=main_fields,
+        aux_fields=aux_fields,
+        source_mtimes=tuple((file, _mtime(file)) for file in dict.fromkeys(source_files)),
+    )
+
+
+def get_schema(config_file: str) -> Schema:
+    """Returns the compiled schema for the config file, compiling it on first use or when any of its source files changed"""
+
+    config_file = os.path.abspath(config_file)
+
+    schema = _schema_cache.get(config_file)
+    if schema is not None and not _is_stale(schema):
+        return schema
+
+    with _schema_cache_lock:
+        # Another thread might have recompiled the schema while we were waiting for the lock
+        schema = _schema_cache.get(config_file)
+        if schema is None or _is_stale(schema):
+            schema = _compile_schema(config_file)
+            _schema_cache[config_file] = schema
+
+    return schema
+
+
+def clear_schema_cache():
+    with _schema_cache_lock:
+        _schema_cache.clear()
@@ -1,18 +1,28 @@
 from ..OPTag.record import Record
 from ..OPTag.common import default_config_file
 from ..OPTag.opt_check import opt_check
+from ..OPTag.schema import Schema, get_schema
+from ..OPTag.layout import LayoutPlan, plan_aux_region
 import ndef
 import cbor2
-import os
-import types
-import yaml
 import re, json, requests
+import struct
+import threading
+import collections
 from datetime import datetime
-from ..OPTag.fields import Fields, EncodeConfig
+from ..OPTag.fields import EncodeConfig
+
+# Seconds to wait for prusament.com when resolving a spool ID
+PRUSAMENT_TIMEOUT = 10
+
+# Blank tag images by handler configuration, so that initializing a tag is just a copy
+_BLANK_TEMPLATES_MAX = 16
+_blank_templates: collections.OrderedDict[tuple, tuple[Schema, bytes, LayoutPlan]] = collections.OrderedDict()
+_blank_templates_lock = threading.Lock()
 
 
 class PrintTagHandler:
-    def __init__(self, config_file = default_config_file, size: int = 320, block_size: int = 4, aux_region_size: int = 32, meta_region = None, max_meta_section_size: int = 8):
+    def __init__(self, config_file = default_config_file, size: int = 320, block_size: int = 4, aux_region_size: int = 32, meta_region = None, max_meta_section_size: int = 8, stable_width_fields: list[str] = (), aux_hot_fields: list[str] = ()):
         self._current_record: Record = None
         self._config_file = config_file
         self._size: int = size
@@ -20,6 +30,11 @@ class PrintTagHandler:
         self._aux_region_size: int = aux_region_size
         self._meta_region = meta_region
         self._max_meta_section_size: int = max_meta_section_size
+        # Hot fields (e.g. consumed_weight) encoded in a fixed width so that updates overwrite just their value
+        self._encode_config = EncodeConfig(stable_width_fields=frozenset(stable_width_fields))
+        # Aux fields updated during normal use, nfc_initialize plans the aux region layout around them
+        self._aux_hot_fields: list[str] = list(aux_hot_fields)
+        self.layout_plan: LayoutPlan = None
 
     @property
     def current_record(self):
@@ -27,7 +42,7 @@ class PrintTagHandler:
 
     @current_record.setter
     def current_record(self, data: bytearray):
-        self._current_record = Record(self._config_file , memoryview(data))
+        self._current_record = Record(self._config_file , memoryview(data), block_size=self._block_size, encode_config=self._encode_config)
 
 
     def bin_to_dict(self, tag_uid = None) -> dict:
@@ -41,11 +56,11 @@ class PrintTagHandler:
             if name == "meta":
                 continue
 
-            unknown_fields = dict()
-            data[name] = region.read(out_unknown_fields=unknown_fields)
+            region_unknown_fields = dict()
+            data[name] = region.read(out_unknown_fields=region_unknown_fields)
 
-            if len(unknown_fields) > 0:
-                unknown_fields[name] = unknown_fields
+            if len(region_unknown_fields) > 0:
+                unknown_fields[name] = region_unknown_fields
 
         output["data"] = data
 
@@ -54,25 +69,85 @@ class PrintTagHandler:
 
         output["uri"] = self._current_record.uri
 
+        # Regions cache their decoded data, so this doesn't decode anything again
         for name, region in self._current_record.regions.items():
             region.fields.validate(region.read())
-            output["opt_check"] = opt_check(self._current_record, tag_uid)
+
+        output["opt_check"] = opt_check(self._current_record, tag_uid)
 
         return output
 
 
-    def patch_bin(self, patch_data: dict) -> bytes:
-        for region_name, region in self._current_record.regions.items():
-            region.update(
-                update_fields=patch_data.get("data", dict()).get(region_name, dict()),
-                remove_fields=patch_data.get("remove", dict()).get(region_name, dict()),
+    def patch_bin(self, patch_data: dict, as_block_edits: bool = False) -> bytes | list[tuple[int, bytes]]:
+        """Applies the patch to the current record.
+
+        Returns the whole tag image, or with as_block_edits only the (block index, data) edits changed since the last sync.
+        """
+        update_data = patch_data.get("data", dict())
+        remove_data = patch_data.get("remove", dict())
+
+        # Only touch the regions that are being patched, the others don't even need to be parsed
+        for region_name in self._current_record.region_names:
+            if region_name not in update_data and region_name not in remove_data:
+                continue
+
+            self._current_record.get_region(region_name).update(
+                update_fields=update_data.get(region_name, dict()),
+                remove_fields=remove_data.get(region_name, dict()),
                 clear=False,
             )
 
+        if as_block_edits:
+            return self._current_record.block_edits()
+
         return self._current_record.data
 
+    @staticmethod
+    def encode_block_edits(edits: list[tuple[int, bytes]], block_size: int = 4) -> bytes:
+        """Encodes block edits for the stack's /blocks endpoint in edits mode.
+
+        Each edit is a big-endian uint16 first block index and a uint8 block count, followed by the blocks' data.
+        """
+        frame = bytearray()
+        for first_block, block_data in edits:
+            block_count = len(block_data) // block_size
+            assert len(block_data) == block_count * block_size, "Edit data not aligned to the block size"
+
+            # Split runs that don't fit into the block count byte
+            for i in range(0, block_count, 255):
+                chunk = block_data[i * block_size : (i + 255) * block_size]
+                frame += struct.pack(">HB", first_block + i, len(chunk) // block_size)
+                frame += chunk
+
+        return bytes(frame)
+
 
     def nfc_initialize(self, ndef_uri: bool = None):
+        """Initializes the current record to a blank tag image.
+
+        The image only depends on the handler configuration, so it is built once and then copied from a template cache.
+        """
+        schema = get_schema(self._config_file)
+        key = (schema.config_file, self._size, self._block_size, self._aux_region_size, self._meta_region, self._max_meta_section_size, self._encode_config, tuple(self._aux_hot_fields), ndef_uri)
+
+        with _blank_templates_lock:
+            template = _blank_templates.get(key)
+            if template is not None and template[0] is schema:
+                _blank_templates.move_to_end(key)
+            else:
+                # Not cached yet or the schema changed since
+                template = (schema, *self._build_blank_image(schema, ndef_uri))
+                _blank_templates[key] = template
+
+                if len(_blank_templates) > _BLANK_TEMPLATES_MAX:
+                    _blank_templates.popitem(last=False)
+
+        _, image, self.layout_plan = template
+        self.current_record = bytearray(image)
+
+        return bytearray(image)
+
+    def _build_blank_image(self, schema: Schema, ndef_uri: str = None) -> tuple[bytes, LayoutPlan]:
 
         def write_section(offset: int, data: bytes):
             enc_len = len(data)
@@ -94,9 +169,8 @@ class PrintTagHandler:
                 return offset - misalignment
 
 
-        config_dir = os.path.dirname(self._config_file)
-        with open(self._config_file, "r", encoding="utf-8") as f:
-            config = types.SimpleNamespace(**yaml.safe_load(f))
+        config = schema.config
+        layout_plan = None
 
         assert config.root == "nfcv", "nfc_initialize only supports NFC-V tags"
 
@@ -175,7 +249,7 @@ class PrintTagHandler:
 
         payload = bytearray(payload_size)
         metadata = dict()
-        meta_fields = Fields.from_file(os.path.join(config_dir, config.meta_fields))
+        meta_fields = schema.meta_fields
 
 
 
@@ -192,7 +266,13 @@ class PrintTagHandler:
         if self._aux_region_size is not None:
             assert self._aux_region_size > 4, "Aux region is too small"
 
-            aux_region_offset = align_region_offset(payload_size - self._aux_region_size, align_up=False)
+            if self._aux_hot_fields:
+                # Size and place the region so that the typical updates rewrite as few blocks as possible
+                layout_plan = plan_aux_region(schema.aux_fields, self._aux_hot_fields, ndef_payload_start, payload_size, self._block_size, self._encode_config, min_size=self._aux_region_size)
+                aux_region_offset = layout_plan.aux_region_offset
+            else:
+                aux_region_offset = align_region_offset(payload_size - self._aux_region_size, align_up=False)
+
             metadata["aux_region_offset"] = aux_region_offset
             write_section(aux_region_offset, cbor2.dumps({}))
 
@@ -233,12 +313,12 @@ class PrintTagHandler:
         # Check that the payload is where we expect it to be
         assert full_data[ndef_payload_start : ndef_payload_start + payload_size] == payload
 
-        self.current_record = bytearray(full_data)
-
-        return bytearray(full_data)
+        return bytes(full_data), layout_plan
     
-    def from_prusament_id(self, id: str):
-        html = requests.get(f"https://prusament.com/spool/?spoolId={id}").text
+    # The spool lookups don't touch the handler state, so a batch can resolve them before owning any stack
+    @staticmethod
+    def from_prusament_id(id: str):
+        html = requests.get(f"https://prusament.com/spool/?spoolId={id}", timeout=PRUSAMENT_TIMEOUT).text
         m = re.search(r"var spoolData\s*=\s*'([^']+)'", html)
         if m:
             data = json.loads(m.group(1))
@@ -247,13 +327,15 @@ class PrintTagHandler:
             return data
 
 
-    def convert_iso_unix(self, timestamp: str) -> int:
+    @staticmethod
+    def convert_iso_unix(timestamp: str) -> int:
         dt = datetime.fromisoformat(timestamp)
         return int(dt.timestamp())
 
 
-    def generate_opt_json(self, id: str) -> dict:
-        web_data: dict = self.from_prusament_id(id)
+    @staticmethod
+    def generate_opt_json(id: str) -> dict:
+        web_data: dict = PrintTagHandler.from_prusament_id(id)
         if not web_data:
             return
         res = {'data':      
@@ -264,7 +346,7 @@ class PrintTagHandler:
                         'material_type': web_data.get('filament').get('material'), 
                         'material_name': web_data.get('filament').get('color_name'), 
                         'brand_name': 'Prusament',
-                        'manufactured_date': self.convert_iso_unix(web_data.get('manufacture_date')),
+                        'manufactured_date': PrintTagHandler.convert_iso_unix(web_data.get('manufacture_date')),
                         'nominal_netto_full_weight': round(web_data.get('weight'),-3),
                         'actual_netto_full_weight': web_data.get('weight'),
                         'empty_container_weight': web_data.get('spool_weight')+19,
@@ -1,15 +1,35 @@
 # coding=utf-8
-from __future__ import absolute_import
-from collections import defaultdict
-from pathlib import Path
+from __future__ import absolute_import, annotations
+import os
 import time
-import struct
+import typing
 import octoprint.plugin
 import flask
-import httpx
 import asyncio
-from .OPTag import PrintTagHandler
-from .predictor import predict_runout_from_tuples
+from .predictionworker import PredictionWorker, NO_RUNOUT_DATE
+from .stackclient import StackClient, is_request_error
+from .discovery import DeviceDiscovery, LeaseWatcher
+from .health import HealthTracker
+from .stackstate import StackState, decode_state_frame, consumed_weight
+from .tagcache import TagCache, image_digest
+from .writebehind import WriteBehind, FlushPolicy
+from .ownership import StackHandlers
+from .warmup import warm_up
+from octoprint.events import Events
+
+# Loaded on first use or by the warmup thread, OctoPrint doesn't wait for them at boot (see warmup.HEAVY_MODULES)
+if typing.TYPE_CHECKING:
+    import httpx
+    from .OPTag import PrintTagHandler
+
+# Unreachable stacks are only probed, with a deadline shorter than the regular requests
+PROBE_TIMEOUT = 1.0
+
+# Consumed weight still off the tags is written before shutting down, bounded by this many seconds
+SHUTDOWN_FLUSH_TIMEOUT = 30.0
+
+# Stacks without the combined /state endpoint are asked again after this many seconds (e.g. after a firmware update)
+STATE_RECHECK_INTERVAL = 3600.0
 
 class ClothopusPlugin(
     octoprint.plugin.SettingsPlugin,
@@ -22,14 +42,66 @@ class ClothopusPlugin(
 ):
 
     def __init__(self):
-        self.taghandlers = defaultdict(PrintTagHandler)
+        # Handlers are only used while owning their stack, see StackHandlers.owned
+        self.taghandlers = StackHandlers(self._create_tag_handler)
+        # All communication with the stacks goes through its loop and connection pool
+        self.stack_client = StackClient()
+        self.discovery = DeviceDiscovery(LeaseWatcher(), self.stack_client)
+        self.health = HealthTracker()
+
+        # Result of the last poll of all stacks, answered by fetch_filaments and pushed to the clients on change
+        self._snapshot = None
+        self._pushed_statuses = None
+        self._poller = None
+        self._probes = set()
+        # mac -> monotonic time until which the legacy endpoints are used
+        self._legacy_stacks = dict()
+        # mac -> (path, ETag, state) of the last read, stacks answer 304 when nothing changed
+        self._stack_etags = dict()
+        self.tag_cache = TagCache()
+        self.write_behind = WriteBehind()
+        # Created on startup with the configured predictor
+        self.prediction_worker = None
+        # uid -> last predicted runout date, shown until the next prediction arrives
+        self._runout_dates = dict()
+        # uid -> (history, nominal_netto_full_weight) of the last submitted prediction
+        self._prediction_keys = dict()
+        self._predictions = None
+        self._poll_lock = asyncio.Lock()
+        self._poll_wakeup = None
 
 
     def on_after_startup(self):
-        pass
+        warm_up()
+        path = os.path.join(self.get_plugin_data_folder(), "predictions.pickle") if self._settings.get_boolean(["persist_predictions"]) else None
+        self.prediction_worker = PredictionWorker(path=path, mode=self._settings.get(["predictor"]))
+        self.prediction_worker.start()
+        self.stack_client.start()
+        self._poller = self.stack_client.submit(self._poll_loop())
 
     def on_shutdown(self):
-        pass
+        if self._poller is not None:
+            self._poller.cancel()
+
+        # Predictions of the last poll would be lost anyway
+        if self.prediction_worker is not None:
+            self.prediction_worker.close()
+            self.prediction_worker = None
+
+        if self.stack_client.running:
+            self.write_behind.request_flush()
+            try:
+                self.stack_client.run(self._poll(), timeout=SHUTDOWN_FLUSH_TIMEOUT)
+            except Exception:
+                self._logger.exception("Writing the consumed weight to the tags failed")
+
+        self.stack_client.close()
+
+    def on_event(self, event, payload):
+        # Everything consumed by the print goes to the tags now, the spools might be taken off afterwards
+        if event in (Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+            self.write_behind.request_flush()
+            self._request_poll()
 
     def on_settings_save(self, data):
         pass
@@ -39,6 +111,19 @@ class ClothopusPlugin(
         return {
             "stacks": {},
             "seen_filaments": {},
+            # Write only changed blocks to the tags, requires stack firmware supporting /blocks?edits
+            "block_edit_writes": False,
+            # Number of stacks polled at the same time, keeps the WiFi from being flooded
+            "max_concurrent_stacks": 8,
+            # Seconds between two background polls of all stacks
+            "poll_interval": 15,
+            # Consumed weight is written to a tag once this many grams are pending, after write_interval seconds, at print end or shutdown
+            "write_threshold": 5.0,
+            "write_interval": 600,
+            # Keep the fitted runout models across restarts
+            "persist_predictions": True,
+            # Runout predictor: "fast" smoothing, "accurate" gradient boosting once there are enough days, or "auto" to pick by history length
+            "predictor": "auto",
         }
 
     def get_template_configs(self):
@@ -63,18 +148,18 @@ class ClothopusPlugin(
             add_stack=["mac", "ip"],
         )
 
-    async def _get_route_of_esps(self, stacks: dict, path: str):
-        async with httpx.AsyncClient() as client:
-            pulls = {mac: client.get(f"http://{ip}{path}") for mac, ip  in stacks.items()}
-            results = await asyncio.gather(*pulls.values(), return_exceptions=True)
-            return dict(zip(pulls.keys(), results))
+    @staticmethod
+    def _create_tag_handler() -> PrintTagHandler:
+        from .OPTag import PrintTagHandler
+
+        # consumed_weight changes on almost every poll, keep its encoding fixed-width so that updates are done in place
+        return PrintTagHandler(stable_width_fields=["consumed_weight"], aux_hot_fields=["consumed_weight"])
 
-    def _init_tag_w_id(self, handler: PrintTagHandler, prusa_id: str):
-        tag_data: dict = handler.generate_opt_json(prusa_id)
-        if not tag_data: return False
+    def _init_tag_w_data(self, handler: PrintTagHandler, prusa_id: str, tag_data: dict):
         handler.nfc_initialize()
+        if handler.layout_plan is not None:
+            self._logger.info(f"Tag {prusa_id} layout: aux region at {handler.layout_plan.aux_region_offset}, blocks written per update: {handler.layout_plan.update_costs}")
         handler.patch_bin(tag_data)
-        return True
 
     def add_timestamp(self, uid, weight):
         filaments = self._settings.get(["seen_filaments"]) or {}
@@ -93,68 +178,336 @@ class ClothopusPlugin(
 
 
 
+    async def _poll_loop(self):
+        """Polls all stacks every poll_interval seconds, or right away when woken up by _request_poll"""
+        self._poll_wakeup = asyncio.Event()
+        while True:
+            try:
+                await self._poll()
+            except Exception:
+                self._logger.exception("Polling the stacks failed")
+
+            try:
+                await asyncio.wait_for(self._poll_wakeup.wait(), timeout=max(1.0, self._settings.get_float(["poll_interval"]) or 15.0))
+            except asyncio.TimeoutError:
+                pass
+            self._poll_wakeup.clear()
+
+    def _request_poll(self):
+        """Makes the poller refresh the snapshot right away, e.g. after the stacks or tags were changed"""
+        if self._poll_wakeup is not None and self.stack_client.running:
+            self.stack_client.loop.call_soon_threadsafe(self._poll_wakeup.set)
+
+    async def _poll(self) -> dict:
+        async with self._poll_lock:
+            stacks = self._settings.get(["stacks"]) or {}
+
+            # Unreachable stacks are left out of the poll, they only get probed in the background until they answer again
+            for mac, ip in stacks.items():
+                if self.health.is_probe_due(mac):
+                    self.health.defer(mac)
+                    probe = asyncio.ensure_future(self._probe_stack(mac, ip))
+                    self._probes.add(probe)
+                    probe.add_done_callback(self._probes.discard)
+
+            results = await self._fetch_stacks({mac: ip for mac, ip in stacks.items() if self.health.is_healthy(mac)})
+            self._submit_predictions([result["prediction"] for result in results.values() if "prediction" in result])
+
+            # A broken tag only takes its own row, the other stacks are still shown
+            filaments = []
+            for mac, result in results.items():
+                if "error" in result:
+                    filaments.append(dict(mac=mac, data=dict(), runout_date=NO_RUNOUT_DATE, error=f"Corrupt tag: {result['error']}"))
+                elif "row" in result:
+                    filaments.append(result["row"])
+            empty = [result["empty"] for result in results.values() if "empty" in result]
+            snapshot = dict(success=True, rows=filaments, empty=empty)
+
+            # Latencies change on every poll, only a change of the status is worth a push
+            health = self.health.snapshot(stacks)
+            statuses = {mac: stack_health["status"] for mac, stack_health in health.items()}
+
+            if snapshot != self._snapshot or statuses != self._pushed_statuses:
+                self._snapshot = snapshot
+                self._pushed_statuses = statuses
+                self._plugin_manager.send_plugin_message(self._identifier, dict(type="filaments", health=health) | snapshot)
+
+            return snapshot
+
+    def _submit_predictions(self, predictions: list[tuple[str, list, float]]):
+        """Predicts the runout of every (uid, history, nominal_netto_full_weight) whose inputs changed, as one batch in the background.
+
+        A finished batch triggers a poll, which shows the new dates. While a batch is running, changes wait for the next poll.
+        """
+        if self.prediction_worker is None or (self._predictions is not None and not self._predictions.done()):
+            return
+
+        requests = dict()
+        for uid, history, nominal_netto_full_weight in predictions:
+            key = (tuple(map(tuple, history)), nominal_netto_full_weight)
+            if self._prediction_keys.get(uid) != key:
+                self._prediction_keys[uid] = key
+                requests[uid] = (history, nominal_netto_full_weight)
+
+        if not requests:
+            return
+
+        self._predictions = asyncio.wrap_future(self.prediction_worker.submit(requests))
+        self._predictions.add_done_callback(lambda predictions: self._predictions_done(requests, predictions))
+
+    def _predictions_done(self, requests: dict, predictions: asyncio.Future):
+        if predictions.cancelled():
+            return
+        elif predictions.exception() is not None:
+            self._logger.error(f"Predicting the runout failed: {predictions.exception()}")
+            # Submitted again with the next poll
+            for uid in requests:
+                self._prediction_keys.pop(uid, None)
+            return
+
+        self._runout_dates.update(predictions.result())
+        self._request_poll()
+
+    async def _probe_stack(self, mac: str, ip: str):
+        start = time.monotonic()
+        try:
+            resp = await self.stack_client.get(f"http://{ip}/reachable", timeout=PROBE_TIMEOUT)
+            resp.raise_for_status()
+        except Exception as e:
+            self.health.record_failure(mac, str(e) or type(e).__name__)
+            return
+
+        self.health.record_success(mac, time.monotonic() - start)
+        self._logger.info(f"Stack {mac} is reachable again")
+        self._request_poll()
+
+    async def _fetch_stacks(self, stacks: dict) -> dict[str, dict]:
+        """Runs the whole poll of every stack concurrently, returns mac -> result of _fetch_stack in the order of stacks.
+
+        A stack failing unexpectedly gets an {"error": ...} result, it doesn't stop the poll of the others.
+        """
+        limit = asyncio.Semaphore(max(1, self._settings.get_int(["max_concurrent_stacks"]) or 1))
+        results = await asyncio.gather(*(self._fetch_stack(limit, mac, ip) for mac, ip in stacks.items()), return_exceptions=True)
+
+        for mac, result in zip(stacks.keys(), results):
+            if isinstance(result, Exception):
+                self._logger.error(f"Polling stack {mac} failed", exc_info=result)
+        return {mac: dict(error=str(result) or type(result).__name__) if isinstance(result, Exception) else result for mac, result in zip(stacks.keys(), results)}
+
+    async def _fetch_stack(self, limit: asyncio.Semaphore, mac: str, ip: str) -> dict:
+        """Reads the tag of a single stack and books the consumed clicks onto it.
+
+        Returns {"row": ..., "prediction": ...}, {"empty": ...}, {"error": ...} or an empty dict for unreachable stacks.
+        The row holds the last predicted runout date, prediction the inputs for a new one.
+        """
+        client = self.stack_client
+        # Owning the stack before taking a network slot, a stack busy with a tag initialization doesn't hold up the others
+        async with self.taghandlers.owned(mac) as handler, limit:
+            start = time.monotonic()
+            try:
+                state = await self._read_stack_state(mac, ip)
+            except Exception as e:
+                if is_request_error(e):
+                    self.health.record_failure(mac, str(e) or type(e).__name__)
+                    return dict()
+
+                # The stack answered, only its state frame is broken - it is read in full again with the next poll
+                self.health.record_success(mac, time.monotonic() - start)
+                self._stack_etags.pop(mac, None)
+                self._logger.warning(f"Decoding the state of stack {mac} failed: {str(e) or type(e).__name__}")
+                return dict()
+            self.health.record_success(mac, time.monotonic() - start)
+
+            if state is None:
+                return dict()
+            elif state.image is None:
+                return dict(empty={"mac": mac, "filament": ""})
+
+
+            sysinfo = None
+            try:
+                # Unchanged image - the record (with its decoded regions) and the row of the last poll are still valid
+                digest = image_digest(state.image)
+                cached = self.tag_cache.get(mac, digest)
+                if cached is None or handler.current_record is None or handler.current_record.data != state.image:
+                    # Fails for images that aren't an OpenPrintTag (blank, foreign or half written tags)
+                    handler.current_record = bytearray(state.image)
+                    cached = None
+
+                # Only the main and aux regions are needed here, the full dict is built once after the update
+                main = handler.current_record.main_region.read(out_unknown_fields=dict())
+                if state.consumed_length is not None:
+                    clicks_consumed = consumed_weight(state.consumed_length, main.get("filament_diameter", 1.75), main["density"])
+                else:
+                    consumed_resp, sysinfo = await asyncio.gather(
+                        client.get(f"http://{ip}/consumed", params={
+                            "filament_diameter": main.get("filament_diameter", 1.75),
+                            "density": main["density"]
+                        }),
+                        client.get(f"http://{ip}/sysinfo"),
+                    )
+                    sysinfo.raise_for_status()
+                    consumed_resp.raise_for_status()
+                    clicks_consumed = consumed_resp.json()["consumed_weight"]
+                consumed = handler.current_record.aux_region.read(out_unknown_fields=dict()).get("consumed_weight", 0)
+                consumed += clicks_consumed
+                if self.write_behind.should_flush(mac, clicks_consumed, self._flush_policy()):
+                    patch = {"data": { "aux": {"consumed_weight": consumed}}}
+                    if self._settings.get_boolean(["block_edit_writes"]):
+                        from .OPTag import PrintTagHandler
+
+                        # Only send the changed blocks, the stack doesn't have to diff the whole image
+                        resp = await client.post(
+                            f"http://{ip}/blocks", params={"retries_per_block": 10, "edits": True, "with_weight": True},
+                            content=PrintTagHandler.encode_block_edits(handler.patch_bin(patch, as_block_edits=True), block_size=handler.current_record.block_size)
+                        )
+                    else:
+                        resp = await client.post(
+                            f"http://{ip}/blocks", params={"retries_per_block": 10, "diff_only": True, "with_weight": True},
+                            content=bytes(handler.patch_bin(patch))
+                        )
+                    resp.raise_for_status()
+                    handler.current_record.mark_synced()
+                    self.write_behind.written(mac)
+                    cached = None
+
+                if cached is None:
+                    cached = self.tag_cache.put(mac, image_digest(handler.current_record.data), handler.bin_to_dict())
+                _info = cached.row
+
+                # The row shows the weight including what is not on the tag yet
+                aux = _info["data"].get("aux", dict())
+                if consumed != aux.get("consumed_weight", 0):
+                    _info = _info | {"data": _info["data"] | {"aux": aux | {"consumed_weight": round(consumed, 3)}}}
+            except Exception as e:
+                self.tag_cache.forget(mac)
+                # The legacy reads or the write back failed - the stack is backed off, not its tag reported as corrupt
+                if is_request_error(e):
+                    self.health.record_failure(mac, str(e) or type(e).__name__)
+                    return dict()
+                return dict(error=str(e) or type(e).__name__)
+
+        # The history is updated on the loop thread, so concurrent stacks don't race on the settings
+        try:
+            uid = state.uid if sysinfo is None else sysinfo.json()["uid"]
+            history = self.add_timestamp(uid, consumed)
+            nominal_netto_full_weight = _info["data"]["main"]["nominal_netto_full_weight"]
+        except Exception as e:
+            return dict(row=_info|{"mac": mac, "runout_date": NO_RUNOUT_DATE})
+        return dict(
+            row=_info|{"mac": mac, "runout_date": self._runout_dates.get(uid, NO_RUNOUT_DATE)},
+            prediction=(uid, history, nominal_netto_full_weight),
+        )
+
+    async def _init_stacks(self, stacks: dict, empties: list[dict]) -> list[dict]:
+        """Initializes the tags of all given stacks concurrently, returns [{"mac": ..., "success": ..., "error": ...}] in the order of empties"""
+        requested = [(str(empty.get("mac")), str(empty.get("filament"))) for empty in empties]
+
+        from .OPTag import PrintTagHandler
+
+        # Every spool ID is looked up once, all of them at the same time
+        prusa_ids = list({prusa_id for mac, prusa_id in requested if mac in stacks})
+        lookups = await asyncio.gather(*(asyncio.to_thread(PrintTagHandler.generate_opt_json, prusa_id) for prusa_id in prusa_ids), return_exceptions=True)
+        tag_data = dict(zip(prusa_ids, lookups))
+
+        limit = asyncio.Semaphore(max(1, self._settings.get_int(["max_concurrent_stacks"]) or 1))
+
+        async def init(mac: str, prusa_id: str) -> dict:
+            if mac not in stacks:
+                error = "Unknown MAC address."
+            elif isinstance(tag_data[prusa_id], Exception):
+                error = f"Looking up the PRUSA-ID failed: {tag_data[prusa_id]}"
+            elif not tag_data[prusa_id]:
+                error = "Invalid PRUSA-ID."
+            else:
+                error = await self._init_stack(limit, mac, stacks[mac], prusa_id, tag_data[prusa_id])
+            return dict(mac=mac, success=error is None, error=error)
+
+        return list(await asyncio.gather(*(init(mac, prusa_id) for mac, prusa_id in requested)))
+
+    async def _init_stack(self, limit: asyncio.Semaphore, mac: str, ip: str, prusa_id: str, tag_data: dict) -> str | None:
+        """Writes a new tag with the data of the prusament ID to the stack, returns an error message on failure"""
+        async with self.taghandlers.owned(mac) as handler, limit:
+            try:
+                # Building the images runs in parallel with the other stacks' network exchanges
+                await asyncio.to_thread(self._init_tag_w_data, handler, prusa_id, tag_data)
+                resp = await self.stack_client.post(f"http://{ip}/blocks", params={"retries_per_block": 10, "diff_only": True, "with_weight": True}, content=bytes(handler.current_record.data))
+            except Exception as e:
+                return str(e) or type(e).__name__
+            if resp.status_code != 200:
+                return str(resp.status_code)
+            return None
+
+    def _flush_policy(self) -> FlushPolicy:
+        return FlushPolicy(
+            interval=self._settings.get_float(["write_interval"]) or 0.0,
+            weight_threshold=self._settings.get_float(["write_threshold"]) or 0.0,
+        )
+
+    async def _read_stack_state(self, mac: str, ip: str) -> StackState | None:
+        """Reads the tag image, UID and consumed filament in a single exchange, falls back to /blocks for stacks without /state.
+
+        Returns None if the stack answered with an unexpected status.
+        """
+        if self._legacy_stacks.get(mac, 0.0) <= time.monotonic():
+            resp, state = await self._conditional_get(mac, ip, "/state")
+            if state is not None:
+                return state
+            elif resp.status_code == 200:
+                return self._remember_etag(mac, "/state", resp, decode_state_frame(resp.content))
+            elif resp.status_code not in (404, 405, 501):
+                return None
+
+            self._logger.info(f"Stack {mac} doesn't support /state, using the legacy endpoints")
+            self._legacy_stacks[mac] = time.monotonic() + STATE_RECHECK_INTERVAL
+
+        resp, state = await self._conditional_get(mac, ip, "/blocks")
+        if state is not None:
+            return state
+        elif resp.status_code == 204:
+            return StackState(image=None)
+        elif resp.status_code == 200:
+            return self._remember_etag(mac, "/blocks", resp, StackState(image=resp.content))
+        return None
+
+    async def _conditional_get(self, mac: str, ip: str, path: str) -> tuple[httpx.Response, StackState | None]:
+        """GETs the path with the ETag of the last read, returns the last state if the stack answered 304 Not Modified"""
+        previous = self._stack_etags.get(mac)
+        headers = {"If-None-Match": previous[1]} if previous is not None and previous[0] == path else {}
+
+        resp = await self.stack_client.get(f"http://{ip}{path}", headers=headers)
+        if resp.status_code == 304 and headers:
+            return resp, previous[2]
+
+        return resp, None
+
+    def _remember_etag(self, mac: str, path: str, resp: httpx.Response, state: StackState) -> StackState:
+        etag = resp.headers.get("ETag")
+        if etag:
+            self._stack_etags[mac] = (path, etag, state)
+        else:
+            self._stack_etags.pop(mac, None)
+        return state
+
+
     def on_api_command(self, command, data: dict):
         stacks = self._settings.get(["stacks"]) or {}
         if command == "fetch_filaments":
-            empty = []
-            filaments = []
-            for mac, resp in asyncio.run(self._get_route_of_esps(stacks, "/blocks")).items():
-                if not isinstance(resp, httpx.Response): continue
-                if resp.status_code == 204:
-                    empty.append({"mac": mac, "filament": ""})
-                elif resp.status_code == 200:
-                    raw = bytearray(resp.content)
-                    handler = self.taghandlers[mac]
-                    handler.current_record = raw
-                    try:
-                        _info = handler.bin_to_dict()
-                        consumed_resp = httpx.get(f"http://{stacks[mac]}/consumed", params={
-                            "filament_diameter": _info["data"]["main"].get("filament_diameter", 1.75),
-                            "density": _info["data"]["main"]["density"]
-                        })
-                        sysinfo = httpx.get(f"http://{stacks[mac]}/sysinfo")
-                        sysinfo.raise_for_status()
-                        consumed_resp.raise_for_status()
-                        clicks_consumed = consumed_resp.json()["consumed_weight"]
-                        consumed = _info["data"]["aux"].get("consumed_weight", 0)
-                        if clicks_consumed != 0:
-                            consumed += clicks_consumed
-                            patch = {"data": { "aux": {"consumed_weight": consumed}}}
-                            # handler.current_record = raw # nur gott weiß
-                            resp = httpx.post(
-                                f"http://{stacks[mac]}/blocks", params={"retries_per_block": 10, "diff_only": True, "with_weight": True},
-                                content=handler.patch_bin(patch)
-                            )
-                            resp.raise_for_status()
-                    except Exception as e:
-                        return flask.jsonify(dict(success=False, error=f"Corrupt tag: {e} @ {mac}"))
-                    try:
-                        pred = predict_runout_from_tuples(self.add_timestamp(sysinfo.json()["uid"], consumed), _info["data"]["main"]["nominal_netto_full_weight"])
-                        runout_date = pred["runout_date"].strftime("%d.%m.%Y")
-                    except Exception as e:
-                        runout_date = "N/A"
-                    filaments.append(handler.bin_to_dict()|{"runout_date": runout_date})
-            return flask.jsonify(dict(success=True, rows=filaments, empty=empty))
+            # Answered from the poller, only the very first request has to wait for the stacks
+            snapshot = self._snapshot
+            if snapshot is None:
+                snapshot = self.stack_client.run(self._poll())
+            return flask.jsonify(snapshot | dict(health=self.health.snapshot(stacks)))
 
         if command == "init_empty_nfc":
-            empties = data.get("empties")
-            for empty in empties:
-                mac = str(empty.get("mac"))
-                ip = stacks.get(mac)
-                if ip is None:
-                    return flask.jsonify(dict(success=False, error="Unknown MAC address."))
-                handler = self.taghandlers[mac]
-                filament = str(empty.get("filament"))
-                resp = self._init_tag_w_id(handler, filament)
-                if not resp: return flask.jsonify(dict(success=False, error="Invalid PRUSA-ID."))
-                # stack.write_tag()
-                try:
-                    resp = httpx.post(f"http://{ip}/blocks", params={"retries_per_block": 10, "diff_only": True, "with_weight": True}, content=bytes(handler.current_record.data))
-                except Exception as e:
-                    return flask.jsonify(dict(success=False, error=str(e)))
-                if resp.status_code != 200:
-                    return flask.jsonify(dict(success=False, error=str(resp.status_code)))
-            return flask.jsonify(dict(success=True))
+            # Failures of single stacks don't stop the others
+            results = self.stack_client.run(self._init_stacks(stacks, data.get("empties")))
+            self._request_poll()
+
+            errors = [f"{result['mac']}: {result['error']}" for result in results if not result["success"]]
+            if errors:
+                return flask.jsonify(dict(success=False, error="\n".join(errors), results=results))
+            return flask.jsonify(dict(success=True, results=results))
 
         if command == "add_stack":
             mac = str(data.get("mac"))
@@ -162,36 +515,26 @@ class ClothopusPlugin(
             stacks[mac] = ip
             self._settings.set(["stacks"], stacks)
             self._settings.save()
+            self._request_poll()
             return flask.jsonify(dict(success=True))
 
         if command == "delete_stack":
             mac = str(data.get("mac"))
             if stacks.pop(mac, None) is None:
                 return flask.jsonify(dict(success=False))
+            self.health.forget(mac)
+            self._legacy_stacks.pop(mac, None)
+            self._stack_etags.pop(mac, None)
+            self.tag_cache.forget(mac)
+            self.write_behind.forget(mac)
+            self.taghandlers.forget(mac)
             self._settings.set(["stacks"], stacks)
             self._settings.save()
+            self._request_poll()
             return flask.jsonify(dict(success=True))
 
         if command == "alive_devices":
-            devices = []
-            with Path("/var/lib/misc/dnsmasq.leases").open() as f:
-                for line in f:
-                    parts = line.split()
-                    if len(parts) < 3:
-                        continue
-                    expiry, mac, ip = int(parts[0]), parts[1], parts[2]
-                    if expiry != 0 and expiry < time.time():
-                        continue
-                    # ping = subprocess.run(["ping", "-I", "wlan0", "-c", "1", "-W", "1", ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    # if ping.returncode == 0:
-                    try:
-                        resp =httpx.get(f"http://{ip}/reachable")
-                        if resp.status_code == 200:
-                            devices.append({"mac": mac, "ip": ip})
-                    except Exception as e:
-                        continue
-
-
+            devices = self.stack_client.run(self.discovery.alive_devices())
             return flask.jsonify(dict(success=True, devices=devices))
 
     def is_api_protected(self):
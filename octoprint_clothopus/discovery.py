@@ -0,0 +1,134 @@
+import asyncio
+import os
+import threading
+import time
+import typing
+
+from .stackclient import StackClient
+
+DEFAULT_LEASES_FILE = "/var/lib/misc/dnsmasq.leases"
+DEFAULT_PROBE_URL = "http://{ip}/reachable"
+
+# A stack answers /reachable in a few ms, anything slower is not worth waiting for in the settings dialog
+DEFAULT_PROBE_TIMEOUT = 1.0
+
+# Upper bound of the whole discovery, the request returns with whatever answered until then
+DEFAULT_DEADLINE = 1.5
+
+# How long the probe results are reused
+DEFAULT_TTL = 10.0
+
+
+class Lease(typing.NamedTuple):
+    expiry: int  # 0 for infinite leases
+    mac: str
+    ip: str
+
+    def expired(self, now: float) -> bool:
+        return self.expiry != 0 and self.expiry < now
+
+
+def parse_lease(line: str) -> Lease | None:
+    """Parses a single line of the dnsmasq leases file, returns None for lines that are not leases"""
+    parts = line.split()
+    if len(parts) < 3:
+        return None
+
+    try:
+        return Lease(int(parts[0]), parts[1], parts[2])
+    except ValueError:
+        return None
+
+
+class LeaseWatcher:
+    """Keeps the parsed contents of a dnsmasq leases file, the file is only read again when it changes"""
+
+    def __init__(self, path: str = DEFAULT_LEASES_FILE):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._stat = None
+        self._leases = ()
+
+        # line -> parsed lease of the previous read, dnsmasq rewrites the whole file but most lines stay the same
+        self._parsed_lines = dict()
+
+    def _read(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._stat = None
+            self._leases = ()
+            self._parsed_lines = dict()
+            return
+
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key == self._stat:
+            return
+
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+
+        previous = self._parsed_lines
+        parsed_lines = dict()
+        for line in lines:
+            parsed_lines[line] = previous[line] if line in previous else parse_lease(line)
+
+        self._stat = key
+        self._parsed_lines = parsed_lines
+        self._leases = tuple(lease for lease in parsed_lines.values() if lease is not None)
+
+    def leases(self, now: float | None = None) -> list[Lease]:
+        """Returns the leases that are not expired"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._read()
+            return [lease for lease in self._leases if not lease.expired(now)]
+
+
+class DeviceDiscovery:
+    """Finds the stacks among the DHCP leases by probing all of them concurrently, the results are cached for ttl seconds"""
+
+    def __init__(self, lease_watcher: LeaseWatcher, stack_client: StackClient, probe_url: str = DEFAULT_PROBE_URL, probe_timeout: float = DEFAULT_PROBE_TIMEOUT, deadline: float = DEFAULT_DEADLINE, ttl: float = DEFAULT_TTL):
+        self.lease_watcher = lease_watcher
+        self.stack_client = stack_client
+        self.probe_url = probe_url
+        self.probe_timeout = probe_timeout
+        self.deadline = deadline
+        self.ttl = ttl
+
+        # (time of the probe, leases that were probed, devices that answered), only accessed from the stack client loop
+        self._cache = None
+
+    async def _probe(self, lease: Lease) -> bool:
+        try:
+            resp = await self.stack_client.get(self.probe_url.format(ip=lease.ip), timeout=self.probe_timeout)
+        except Exception:
+            return False
+
+        return resp.status_code == 200
+
+    async def alive_devices(self) -> list[dict]:
+        """Returns [{"mac": ..., "ip": ...}] of the leases that answered the probe, in the order of the leases file"""
+        now = time.monotonic()
+        leases = await asyncio.to_thread(self.lease_watcher.leases)
+
+        # The cache is only valid as long as the leases didn't change
+        if self._cache is not None and now - self._cache[0] < self.ttl and self._cache[1] == leases:
+            return self._cache[2]
+
+        tasks = [asyncio.ensure_future(self._probe(lease)) for lease in leases]
+        if tasks:
+            # Stragglers are dropped, the request latency is bounded by the deadline
+            _, pending = await asyncio.wait(tasks, timeout=self.deadline)
+            for task in pending:
+                task.cancel()
+
+        devices = [
+            {"mac": lease.mac, "ip": lease.ip}
+            for lease, task in zip(leases, tasks)
+            if task.done() and not task.cancelled() and task.result()
+        ]
+
+        self._cache = (now, leases, devices)
+        return devices
@@ -0,0 +1,108 @@
+import dataclasses
+import threading
+import time
+
+# Weight of the newest sample in the latency average
+LATENCY_ALPHA = 0.3
+
+# First backoff after a failure, doubled with every further failure up to MAX_BACKOFF (seconds)
+BASE_BACKOFF = 10.0
+MAX_BACKOFF = 600.0
+
+# Consecutive failures after which a stack is reported as dead rather than degraded
+DEAD_AFTER = 3
+
+
+@dataclasses.dataclass
+class StackHealth:
+    consecutive_failures: int = 0
+    last_success: float | None = None  # Wall clock
+    last_error: str | None = None
+    latency_ewma: float | None = None  # Seconds
+
+    # Monotonic time before which the stack is not contacted again
+    retry_at: float = 0.0
+
+    @property
+    def status(self) -> str:
+        if self.consecutive_failures == 0:
+            return "ok"
+        elif self.consecutive_failures < DEAD_AFTER:
+            return "degraded"
+        else:
+            return "dead"
+
+    def as_dict(self) -> dict:
+        return dict(
+            status=self.status,
+            consecutive_failures=self.consecutive_failures,
+            last_success=self.last_success,
+            last_error=self.last_error,
+            latency_ms=None if self.latency_ewma is None else round(self.latency_ewma * 1000),
+        )
+
+
+class HealthTracker:
+    """Per-MAC reachability of the stacks. Failing stacks are backed off exponentially and should only be probed until they answer again."""
+
+    def __init__(self, base_backoff: float = BASE_BACKOFF, max_backoff: float = MAX_BACKOFF, alpha: float = LATENCY_ALPHA):
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._stacks: dict[str, StackHealth] = dict()
+
+    def _get(self, mac: str) -> StackHealth:
+        health = self._stacks.get(mac)
+        if health is None:
+            health = self._stacks[mac] = StackHealth()
+        return health
+
+    def record_success(self, mac: str, latency: float):
+        with self._lock:
+            health = self._get(mac)
+            health.consecutive_failures = 0
+            health.last_success = time.time()
+            health.last_error = None
+            health.retry_at = 0.0
+
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma += self.alpha * (latency - health.latency_ewma)
+
+    def record_failure(self, mac: str, error: str):
+        with self._lock:
+            health = self._get(mac)
+            health.consecutive_failures += 1
+            health.last_error = error
+
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (health.consecutive_failures - 1))
+            health.retry_at = time.monotonic() + backoff
+
+    def is_healthy(self, mac: str) -> bool:
+        """Healthy stacks are polled normally, the others only get probed"""
+        with self._lock:
+            health = self._stacks.get(mac)
+            return health is None or health.consecutive_failures == 0
+
+    def is_probe_due(self, mac: str) -> bool:
+        with self._lock:
+            health = self._stacks.get(mac)
+            return health is not None and health.consecutive_failures > 0 and time.monotonic() >= health.retry_at
+
+    def defer(self, mac: str):
+        """Pushes the next probe out by the current backoff, so that a probe still in flight isn't started twice"""
+        with self._lock:
+            health = self._get(mac)
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** max(0, health.consecutive_failures - 1))
+            health.retry_at = time.monotonic() + backoff
+
+    def forget(self, mac: str):
+        with self._lock:
+            self._stacks.pop(mac, None)
+
+    def snapshot(self, macs) -> dict[str, dict]:
+        with self._lock:
+            return {mac: (self._stacks.get(mac) or StackHealth()).as_dict() for mac in macs}
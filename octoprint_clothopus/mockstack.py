@@ -0,0 +1,167 @@
+"""Local stand-in for a stack's HTTP API, for working on the plugin without hardware.
+
+Run: python -m octoprint_clothopus.mockstack --port 8080 [--tag image.bin] [--legacy]
+"""
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import struct
+import threading
+import time
+import urllib.parse
+
+from .stackstate import StackState, encode_state_frame, consumed_weight
+
+BLOCK_SIZE = 4
+
+
+class MockStack:
+    """Emulates the tag and the consumption counter of a single stack"""
+
+    def __init__(self, image: bytes | None = None, uid: str = "E0040150AABBCCDD", consume_rate: float = 0.0, supports_state: bool = True):
+        self.image = bytearray(image) if image is not None else None
+        self.uid = uid
+        self.supports_state = supports_state
+
+        # mm of filament per second
+        self.consume_rate = consume_rate
+        self.consumed_length = 0.0
+        self._consumed_since = time.monotonic()
+
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+
+    def consume(self, length: float):
+        with self.lock:
+            self.consumed_length += length
+
+    def _update_consumed(self):
+        now = time.monotonic()
+        self.consumed_length += self.consume_rate * (now - self._consumed_since)
+        self._consumed_since = now
+
+    def _apply_block_edits(self, frame: bytes):
+        pos = 0
+        while pos < len(frame):
+            first_block, block_count = struct.unpack_from(">HB", frame, pos)
+            pos += 3
+            length = block_count * BLOCK_SIZE
+            self.image[first_block * BLOCK_SIZE : first_block * BLOCK_SIZE + length] = frame[pos : pos + length]
+            pos += length
+
+    def handle(self, method: str, path: str, params: dict[str, str], body: bytes, if_none_match: str | None = None) -> tuple[int, str, bytes]:
+        """Returns (status, content type, body). Reads are answered with an empty 304 when if_none_match equals the ETag of the content."""
+        status, content_type, content = self._handle(method, path, params, body)
+
+        if method == "GET" and status == 200 and if_none_match is not None and if_none_match == self.etag(content):
+            return 304, content_type, b""
+
+        return status, content_type, content
+
+    @staticmethod
+    def etag(content: bytes) -> str:
+        return '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+
+    def _handle(self, method: str, path: str, params: dict[str, str], body: bytes) -> tuple[int, str, bytes]:
+        with self.lock:
+            self.requests[(method, path)] += 1
+            self._update_consumed()
+
+            match (method, path):
+                case ("GET", "/reachable"):
+                    return 200, "text/plain", b"OK"
+
+                case ("GET", "/sysinfo"):
+                    return 200, "application/json", json.dumps({"uid": self.uid}).encode()
+
+                case ("GET", "/blocks"):
+                    if self.image is None:
+                        return 204, "application/octet-stream", b""
+                    return 200, "application/octet-stream", bytes(self.image)
+
+                case ("GET", "/consumed"):
+                    weight = consumed_weight(self.consumed_length, float(params.get("filament_diameter", 1.75)), float(params["density"]))
+                    return 200, "application/json", json.dumps({"consumed_weight": weight}).encode()
+
+                case ("GET", "/state") if self.supports_state:
+                    state = StackState(image=bytes(self.image) if self.image is not None else None, uid=self.uid, consumed_length=self.consumed_length)
+                    return 200, "application/octet-stream", encode_state_frame(state)
+
+                case ("POST", "/blocks"):
+                    if params.get("edits", "").lower() == "true":
+                        assert self.image is not None, "No tag to edit"
+                        self._apply_block_edits(body)
+                    else:
+                        self.image = bytearray(body)
+
+                    # The written tag now contains the consumed weight
+                    if params.get("with_weight", "").lower() == "true":
+                        self.consumed_length = 0.0
+
+                    return 200, "text/plain", b"OK"
+
+            return 404, "text/plain", b"Not found"
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self, method: str):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        status, content_type, content = self.server.stack.handle(method, url.path, params, body, self.headers.get("If-None-Match"))
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if method == "GET" and status in (200, 304) and url.path in ("/state", "/blocks"):
+            self.send_header("ETag", MockStack.etag(content) if status == 200 else self.headers.get("If-None-Match"))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(stack: MockStack, host: str = "127.0.0.1", port: int = 0) -> http.server.ThreadingHTTPServer:
+    """Serves the stack on a background thread, port 0 picks a free port (see server.server_address)"""
+    server = http.server.ThreadingHTTPServer((host, port), _RequestHandler)
+    server.daemon_threads = True
+    server.stack = stack
+    threading.Thread(target=server.serve_forever, name="clothopus-mockstack", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves a mock Clothopus stack")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--tag", help="File with the tag image, no tag on the stack if omitted")
+    parser.add_argument("--uid", default="E0040150AABBCCDD")
+    parser.add_argument("--consume-rate", type=float, default=1.0, help="Consumed filament in mm per second")
+    parser.add_argument("--legacy", action="store_true", help="Don't provide the combined /state endpoint")
+    args = parser.parse_args()
+
+    image = None
+    if args.tag:
+        with open(args.tag, "rb") as f:
+            image = f.read()
+
+    stack = MockStack(image, uid=args.uid, consume_rate=args.consume_rate, supports_state=not args.legacy)
+    server = serve(stack, args.host, args.port)
+    print(f"Mock stack listening on {server.server_address[0]}:{server.server_address[1]}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
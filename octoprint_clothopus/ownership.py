@@ -0,0 +1,42 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from .OPTag import PrintTagHandler
+
+
+class StackHandlers:
+    """The PrintTagHandler of every stack, together with the lock that owns it.
+
+    A handler (and its current_record) may only be used while its stack is owned. Owners of the same stack are served in
+    order, different stacks don't wait for each other. Only to be used from the stack client loop.
+    """
+
+    def __init__(self, factory: typing.Callable[[], PrintTagHandler]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._handlers: dict[str, PrintTagHandler] = dict()
+        self._locks: dict[str, asyncio.Lock] = dict()
+
+    def _get(self, mac: str) -> tuple[PrintTagHandler, asyncio.Lock]:
+        with self._lock:
+            if mac not in self._handlers:
+                self._handlers[mac] = self._factory()
+                self._locks[mac] = asyncio.Lock()
+
+            return self._handlers[mac], self._locks[mac]
+
+    @contextlib.asynccontextmanager
+    async def owned(self, mac: str) -> typing.AsyncIterator[PrintTagHandler]:
+        handler, lock = self._get(mac)
+        async with lock:
+            yield handler
+
+    def forget(self, mac: str):
+        # A current owner keeps its handler, the next one starts with a fresh one
+        with self._lock:
+            self._handlers.pop(mac, None)
+            self._locks.pop(mac, None)
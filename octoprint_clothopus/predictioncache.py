@@ -0,0 +1,116 @@
+import collections
+import dataclasses
+import logging
+import os
+import pickle
+import threading
+
+from .predictors import select_predictor
+
+# Bump when the pickled entries change
+_FORMAT_VERSION = 2
+
+DEFAULT_MAX_SPOOLS = 64
+
+
+@dataclasses.dataclass
+class _Entry:
+    # The model only depends on the consumption history and the predictor that fitted it
+    history: tuple
+    predictor: str
+    model: object | None
+
+    # Last prediction with it, the nominal weight only changes where the forecast stops
+    nominal_netto_full_weight: float | None = None
+    result: dict | Exception | None = None
+
+
+class PredictionCache:
+    """Fitted runout models and their last prediction per spool UID, least recently used spools are evicted.
+
+    A spool's model is only refit when its history changes, i.e. when add_timestamp appended a new day or the
+    consumption of a day changed. With a path, the entries are persisted so that a restart doesn't refit every spool.
+    """
+
+    def __init__(self, max_spools: int = DEFAULT_MAX_SPOOLS, path: str | None = None, mode: str = "auto"):
+        self.max_spools = max_spools
+        self.path = path
+        self.mode = mode
+
+        self._lock = threading.Lock()
+        self._entries: collections.OrderedDict[str, _Entry] = collections.OrderedDict()
+        self._logger = logging.getLogger(__name__)
+
+        if path is not None:
+            self._load()
+
+    def predict(self, uid: str, history: list, nominal_netto_full_weight: float) -> dict:
+        """Prediction of the spool's predictor (see select_predictor), raises the same errors"""
+        history = tuple(map(tuple, history))
+        predictor = select_predictor(self.mode, history)
+
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is not None:
+                self._entries.move_to_end(uid)
+
+        fitted = entry is not None and entry.history == history and entry.predictor == predictor.name
+        if fitted and entry.nominal_netto_full_weight == nominal_netto_full_weight:
+            if isinstance(entry.result, Exception):
+                raise entry.result
+            return entry.result
+
+        # Fitting runs outside the lock, different spools are predicted in parallel
+        model = entry.model if fitted else None
+        try:
+            result = predictor.predict(list(history), nominal_netto_full_weight, model=model)
+        except Exception as e:
+            result = e
+
+        entry = _Entry(history, predictor.name, result.get("model") if isinstance(result, dict) else None, nominal_netto_full_weight, result)
+        with self._lock:
+            self._entries[uid] = entry
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_spools:
+                self._entries.popitem(last=False)
+
+        if model is None:
+            self._save()
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            self._logger.exception(f"Discarding the prediction cache {self.path}")
+            return
+
+        if version != _FORMAT_VERSION:
+            return
+
+        with self._lock:
+            self._entries.update(entries)
+            while len(self._entries) > self.max_spools:
+                self._entries.popitem(last=False)
+
+    def _save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            entries = collections.OrderedDict(self._entries)
+
+        # Written to a temporary file first, a crash never leaves a half written cache behind
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((_FORMAT_VERSION, entries), f)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            self._logger.exception(f"Saving the prediction cache {self.path} failed")
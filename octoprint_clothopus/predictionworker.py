@@ -0,0 +1,85 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+
+# Formatted runout date of spools without a prediction
+NO_RUNOUT_DATE = "N/A"
+
+# Cache of the worker process, see _init_worker
+_cache = None
+
+
+def _init_worker(path: str | None, mode: str):
+    """Runs once in the worker process: imports pandas and sklearn before the first batch arrives and creates its cache"""
+    global _cache
+    from .predictioncache import PredictionCache
+
+    _cache = PredictionCache(path=path, mode=mode)
+
+
+def _predict_batch(requests: dict[str, tuple[list, float]]) -> dict[str, str]:
+    """uid -> (history, nominal_netto_full_weight) to uid -> formatted runout date, runs in the worker process"""
+    runout_dates = dict()
+    for uid, (history, nominal_netto_full_weight) in requests.items():
+        try:
+            pred = _cache.predict(uid, history, nominal_netto_full_weight)
+            runout_dates[uid] = pred["runout_date"].strftime("%d.%m.%Y")
+        except Exception:
+            runout_dates[uid] = NO_RUNOUT_DATE
+    return runout_dates
+
+
+class PredictionWorker:
+    """Runs the runout predictions in a separate process, away from the stack loop and the OctoPrint web server.
+
+    All spools of a poll are submitted as one batch. A single process keeps the fitted models of all spools in its
+    PredictionCache, so every spool only gets refit when its history changed.
+    """
+
+    def __init__(self, path: str | None = None, mode: str = "auto"):
+        self.path = path
+        self.mode = mode
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+
+            # Forking would copy the threads of OctoPrint in whatever state they are
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.path, self.mode),
+            )
+
+            # Starts the process right away, the imports are done by the time the first poll is through
+            self._executor.submit(_predict_batch, dict())
+
+    def submit(self, requests: dict[str, tuple[list, float]]) -> concurrent.futures.Future:
+        """Predicts uid -> (history, nominal_netto_full_weight), the future results in uid -> formatted runout date"""
+        with self._lock:
+            assert self._executor is not None, "The prediction worker is not running"
+            try:
+                return self._executor.submit(_predict_batch, requests)
+            except concurrent.futures.process.BrokenProcessPool:
+                # The worker died (e.g. out of memory), the next batch gets a fresh one
+                self._logger.warning("The prediction worker died, restarting it")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+        self.start()
+        return self.submit(requests)
+
+    def close(self):
+        with self._lock:
+            if self._executor is None:
+                return
+
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
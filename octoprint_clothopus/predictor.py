@@ -5,13 +5,122 @@ from sklearn.metrics import mean_absolute_error
 import random
 
 
-def predict_runout_cumulative(df: pd.DataFrame, total_material_weight, x_col="x", y_col="y", max_forecast_days=365):
+FORECAST_FEATURES = [
+    "day_index",
+    "weekday",
+    "is_weekend",
+    "month",
+    "year_sin",
+    "year_cos",
+    "consumption_lag_1",
+    "consumption_lag_7",
+    "consumption_avg_7",
+    "consumption_avg_28",
+]
+
+# Days predicted by a single model.predict call
+FORECAST_BLOCK_DAYS = 32
+
+
+def _calendar_features(first_date: pd.Timestamp, dates: pd.DatetimeIndex) -> np.ndarray:
+    """day_index, weekday, is_weekend, month, year_sin, year_cos of the dates, computed the same way as for the training data"""
+
+    result = np.empty((len(dates), 6))
+    for i, date in enumerate(dates):
+        weekday = date.weekday()
+        result[i] = (
+            (date - first_date).days,
+            weekday,
+            int(weekday in [5, 6]),
+            date.month,
+            np.sin(2 * np.pi * date.dayofyear / 365.25),
+            np.cos(2 * np.pi * date.dayofyear / 365.25),
+        )
+
+    return result
+
+
+def forecast_recursive(model, consumption: np.ndarray, first_date: pd.Timestamp, latest_date: pd.Timestamp, current_consumed: float, total_material_weight, max_forecast_days: int = 365) -> pd.DataFrame:
+    """Predicts the daily consumption day by day, each prediction feeding the lag and average features of the following days.
+
+    The calendar features of the whole horizon are known ahead, so days are predicted in blocks: the lag features of a
+    block are filled with guessed predictions, and every day up to (including) the first one whose prediction differs
+    from its guess is exact. The rest of the block is predicted again with the new predictions as guesses. The result is
+    the same as predicting one day at a time, with far fewer model calls. Stops with the block in which the material
+    runs out.
+    """
+
+    history_length = len(consumption)
+    assert history_length >= 7, "The lag features need at least a week of history"
+
+    # Known consumption followed by the predictions (exact ones up to history_length + done, guesses after that)
+    buffer = np.empty(history_length + max_forecast_days)
+    buffer[:history_length] = consumption
+
+    dates = pd.date_range(latest_date + pd.Timedelta(days=1), periods=max_forecast_days, freq="D")
+    calendar = _calendar_features(first_date, dates)
+
+    features = np.empty((FORECAST_BLOCK_DAYS, len(FORECAST_FEATURES)))
+    cumulative = np.empty(max_forecast_days)
+    cumulative_consumed = current_consumed
+
+    done = 0
+    guessed = 0  # Days after done that already hold a guess
+    while done < max_forecast_days:
+        count = min(FORECAST_BLOCK_DAYS, max_forecast_days - done)
+        start = history_length + done
+
+        # Steady consumption is the guess for days without one
+        if guessed < count:
+            buffer[start + guessed : start + count] = buffer[start + guessed - 1]
+
+        block = features[:count]
+        block[:, :6] = calendar[done : done + count]
+        for i in range(count):
+            day = start + i
+            block[i, 6] = buffer[day - 1]
+            block[i, 7] = buffer[day - 7]
+            block[i, 8] = buffer[day - 7 : day].mean()
+            block[i, 9] = buffer[max(0, day - 28) : day].mean()
+
+        predicted = np.maximum(model.predict(pd.DataFrame(block, columns=FORECAST_FEATURES)), 0)
+
+        # The first day is always exact, the following ones as long as their guess was right
+        mismatches = np.flatnonzero(predicted != buffer[start : start + count])
+        exact = count if len(mismatches) == 0 else mismatches[0] + 1
+
+        buffer[start : start + count] = predicted
+        guessed = count - exact
+
+        # Same summation order as adding day by day
+        cumulative[done : done + exact] = np.cumsum(np.concatenate(([cumulative_consumed], predicted[:exact])))[1:]
+        cumulative_consumed = cumulative[done + exact - 1]
+
+        crossed = np.flatnonzero(cumulative[done : done + exact] >= total_material_weight)
+        if len(crossed):
+            done += crossed[0] + 1
+            break
+
+        done += exact
+
+    predicted = buffer[history_length : history_length + done]
+    return pd.DataFrame({
+        "date": dates[:done],
+        "predicted_daily_consumption": predicted,
+        "predicted_cumulative_consumed": cumulative[:done],
+        "predicted_remaining_weight": total_material_weight - cumulative[:done],
+    })
+
+
+def predict_runout_cumulative(df: pd.DataFrame, total_material_weight, x_col="x", y_col="y", max_forecast_days=365, model=None):
     """
     df[x_col] = time.time() // 86400
     df[y_col] = cumulative consumed weight, e.g. 1120, 1120, 1180, ...
 
     total_material_weight = total available material before it runs out,
     e.g. 25000 grams.
+
+    model = model fitted on the same data by an earlier call, skips the fit.
     """
 
     df = df.copy()
@@ -75,72 +184,25 @@ def predict_runout_cumulative(df: pd.DataFrame, total_material_weight, x_col="x"
             "Try collecting more data or remove the 28-day rolling average feature."
         )
 
-    features = [
-        "day_index",
-        "weekday",
-        "is_weekend",
-        "month",
-        "year_sin",
-        "year_cos",
-        "consumption_lag_1",
-        "consumption_lag_7",
-        "consumption_avg_7",
-        "consumption_avg_28",
-    ]
-
-    X = df[features]
+    X = df[FORECAST_FEATURES]
     y = df["consumption"]
 
-    model = HistGradientBoostingRegressor(random_state=42)
-    model.fit(X, y)
+    if model is None:
+        model = HistGradientBoostingRegressor(random_state=42)
+        model.fit(X, y)
 
     fitted = model.predict(X)
     mae = mean_absolute_error(y, fitted)
 
-    latest_date = df.index[-1]
-    cumulative_consumed = current_consumed
-
-    consumption_history = list(df["consumption"].values)
-    forecast = []
-
-    for i in range(1, max_forecast_days + 1):
-        future_date = latest_date + pd.Timedelta(days=i)
-        recent = pd.Series(consumption_history)
-
-        row = {
-            "day_index": (future_date - df.index.min()).days,
-            "weekday": future_date.weekday(),
-            "is_weekend": int(future_date.weekday() in [5, 6]),
-            "month": future_date.month,
-            "year_sin": np.sin(2 * np.pi * future_date.dayofyear / 365.25),
-            "year_cos": np.cos(2 * np.pi * future_date.dayofyear / 365.25),
-            "consumption_lag_1": recent.iloc[-1],
-            "consumption_lag_7": recent.iloc[-7] if len(recent) >= 7 else recent.mean(),
-            "consumption_avg_7": recent.tail(7).mean(),
-            "consumption_avg_28": recent.tail(28).mean(),
-        }
-
-        X_future = pd.DataFrame([row])[features]
-
-        predicted_daily_consumption = float(model.predict(X_future)[0])
-        predicted_daily_consumption = max(0, predicted_daily_consumption)
-
-        cumulative_consumed += predicted_daily_consumption
-        remaining_weight = total_material_weight - cumulative_consumed
-
-        consumption_history.append(predicted_daily_consumption)
-
-        forecast.append({
-            "date": future_date,
-            "predicted_daily_consumption": predicted_daily_consumption,
-            "predicted_cumulative_consumed": cumulative_consumed,
-            "predicted_remaining_weight": remaining_weight,
-        })
-
-        if cumulative_consumed >= total_material_weight:
-            break
-
-    forecast_df = pd.DataFrame(forecast)
+    forecast_df = forecast_recursive(
+        model,
+        consumption=df["consumption"].to_numpy(dtype=float),
+        first_date=df.index.min(),
+        latest_date=df.index[-1],
+        current_consumed=current_consumed,
+        total_material_weight=total_material_weight,
+        max_forecast_days=max_forecast_days,
+    )
 
     if len(forecast_df) == 0:
         runout_date = None
@@ -159,7 +221,7 @@ def predict_runout_cumulative(df: pd.DataFrame, total_material_weight, x_col="x"
         "model": model,
     }
 
-def predict_runout_from_tuples(data, total_material_weight, max_forecast_days=365):
+def predict_runout_from_tuples(data, total_material_weight, max_forecast_days=365, model=None):
     """
     data = [
         (unix_day, cumulative_consumed_weight),
@@ -176,7 +238,7 @@ def predict_runout_from_tuples(data, total_material_weight, max_forecast_days=36
     """
 
     df = pd.DataFrame(data, columns=["x", "y"])
-    return predict_runout_cumulative(df=df, total_material_weight=total_material_weight, x_col="x", y_col="y", max_forecast_days=max_forecast_days)
+    return predict_runout_cumulative(df=df, total_material_weight=total_material_weight, x_col="x", y_col="y", max_forecast_days=max_forecast_days, model=model)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+import datetime
+import typing
+
+import numpy as np
+
+from .predictor import predict_runout_from_tuples
+
+# Days of history from which the "auto" mode uses the accurate backend
+AUTO_ACCURATE_MIN_DAYS = 28
+
+# The accurate backend needs 14 days of consumption, i.e. 15 days of history
+ACCURATE_MIN_DAYS = 15
+
+# Weight of the latest day in the smoothed daily consumption
+SMOOTHING_ALPHA = 0.1
+
+PREDICTOR_MODES = ("auto", "fast", "accurate")
+
+_UNIX_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class RunoutPredictor(typing.Protocol):
+    """Predicts when a spool runs out from its history of (unix_day, cumulative_consumed_weight) tuples.
+
+    predict returns a dict with at least runout_date (None if not within max_forecast_days) and model, which is passed
+    back on the next call with the same history to skip the fit.
+    """
+
+    name: str
+
+    def predict(self, history: list, total_material_weight: float, max_forecast_days: int = 365, model=None) -> dict: ...
+
+
+class AccuratePredictor:
+    """Gradient boosting on calendar and recent consumption features, see predictor.py"""
+
+    name = "accurate"
+
+    def predict(self, history: list, total_material_weight: float, max_forecast_days: int = 365, model=None) -> dict:
+        return predict_runout_from_tuples(history, total_material_weight, max_forecast_days=max_forecast_days, model=model)
+
+
+class SmoothingPredictor:
+    """Extrapolates the exponentially smoothed daily consumption, needs two days of history"""
+
+    name = "fast"
+
+    def __init__(self, alpha: float = SMOOTHING_ALPHA):
+        self.alpha = alpha
+
+    def predict(self, history: list, total_material_weight: float, max_forecast_days: int = 365, model=None) -> dict:
+        days, consumed = daily_consumed(history)
+        if len(days) < 2:
+            raise ValueError("Not enough daily data, at least two days are needed.")
+
+        latest_date = _UNIX_EPOCH + datetime.timedelta(days=int(days[-1]))
+        current_consumed = float(consumed[-1])
+        if current_consumed >= total_material_weight:
+            return {
+                "runout_date": latest_date,
+                "message": "Material is already predicted to be empty.",
+                "daily_consumption": None,
+                "model": None,
+            }
+
+        # Like predict_runout_cumulative: no reading means no consumption, negative consumption means a reset
+        consumption = np.diff(consumed).clip(min=0)
+
+        # The weights are normalized, so a short history isn't biased towards zero
+        weights = (1 - self.alpha) ** np.arange(len(consumption))[::-1]
+        rate = float(weights @ consumption / weights.sum())
+
+        runout_date = None
+        if rate > 0:
+            remaining_days = int(np.ceil((total_material_weight - current_consumed) / rate))
+            if remaining_days <= max_forecast_days:
+                runout_date = latest_date + datetime.timedelta(days=remaining_days)
+
+        return {
+            "runout_date": runout_date,
+            "daily_consumption": rate,
+            "model": None,
+        }
+
+
+def daily_consumed(history: list) -> tuple[np.ndarray, np.ndarray]:
+    """Unix days from the first to the last one of the history and the cumulative consumed weight on each of them.
+
+    Days without a reading keep the weight of the day before, of several readings on a day the last one is used.
+    """
+    history = np.asarray(history, dtype=float).reshape(-1, 2)
+    if len(history) == 0:
+        return np.empty(0), np.empty(0)
+
+    history = history[np.argsort(history[:, 0], kind="stable")]
+    reading_days = history[:, 0].astype(int)
+
+    days = np.arange(reading_days[0], reading_days[-1] + 1)
+    # Index of the last reading on or before each day
+    latest = np.searchsorted(reading_days, days, side="right") - 1
+    return days, history[latest, 1]
+
+
+def history_days(history: list) -> int:
+    if len(history) == 0:
+        return 0
+    return int(max(day for day, _ in history) - min(day for day, _ in history)) + 1
+
+
+PREDICTORS: dict[str, RunoutPredictor] = {
+    "fast": SmoothingPredictor(),
+    "accurate": AccuratePredictor(),
+}
+
+
+def select_predictor(mode: str, history: list) -> RunoutPredictor:
+    """The predictor of a spool: always fast, or accurate from AUTO_ACCURATE_MIN_DAYS ("auto") or as soon as it can ("accurate")"""
+    assert mode in PREDICTOR_MODES, f"Unknown predictor mode {mode}"
+
+    match mode:
+        case "fast":
+            return PREDICTORS["fast"]
+        case "accurate":
+            min_days = ACCURATE_MIN_DAYS
+        case "auto":
+            min_days = AUTO_ACCURATE_MIN_DAYS
+
+    return PREDICTORS["accurate"] if history_days(history) >= min_days else PREDICTORS["fast"]
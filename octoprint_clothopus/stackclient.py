@@ -0,0 +1,131 @@
+from __future__ import annotations
+import asyncio
+import threading
+import typing
+import urllib.parse
+
+if typing.TYPE_CHECKING:
+    import httpx
+
+# Stack webservers (ESP32) only handle a few sockets at once
+DEFAULT_CONNECTIONS_PER_STACK = 2
+DEFAULT_MAX_CONNECTIONS = 64
+
+# Keep connections to the stacks open between polls, the TCP setup over WiFi costs more than the request itself
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# Timeouts are (connect, read, write, pool) tuples as accepted by httpx, which is only imported with the first request
+
+# Stacks are on the local network - fail fast on connect, but give the tag reads some time
+DEFAULT_TIMEOUT = (2.0, 8.0, 5.0, 10.0)
+
+# Tag writes retry every block on the stack, which can take a while
+WRITE_TIMEOUT = (2.0, 30.0, 5.0, 10.0)
+
+
+def is_request_error(error: BaseException) -> bool:
+    """Whether the error comes from the exchange with the stack (connection, timeout, HTTP status) rather than what it sent"""
+    import httpx
+
+    return isinstance(error, (httpx.HTTPError, asyncio.TimeoutError))
+
+
+class StackClient:
+    """Owns a background event loop and a single pooled keep-alive HTTP client used for all communication with the stacks.
+
+    Coroutines are submitted from other threads (e.g. the Flask request threads) with run(). The client is created
+    with the first request.
+    """
+
+    loop: asyncio.AbstractEventLoop | None
+    client: httpx.AsyncClient | None
+
+    def __init__(self, connections_per_stack: int = DEFAULT_CONNECTIONS_PER_STACK, max_connections: int = DEFAULT_MAX_CONNECTIONS, timeout: httpx.Timeout | tuple = DEFAULT_TIMEOUT):
+        self.connections_per_stack = connections_per_stack
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        self.loop = None
+        self.client = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # host -> semaphore, only accessed from the loop thread
+        self._host_limits = dict()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name="clothopus-stacks", daemon=True)
+            self._thread.start()
+
+    def _create_client(self) -> httpx.AsyncClient:
+        import httpx
+
+        # httpx has no per-host limit, that is done by the host semaphores
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY)
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout)
+
+    def close(self):
+        with self._lock:
+            if not self.running:
+                return
+
+            try:
+                self.run(self._shutdown(), timeout=5)
+            finally:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self._thread.join(timeout=5)
+                self.loop.close()
+
+                self.loop = None
+                self.client = None
+                self._thread = None
+                self._host_limits.clear()
+
+    async def _shutdown(self):
+        # Pollers and probes still running on the loop are cancelled before the client goes away
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.client is not None:
+            await self.client.aclose()
+
+    def run(self, coro: typing.Coroutine, timeout: float | None = None):
+        """Runs the coroutine on the background loop and waits for its result"""
+        assert self.loop is not None, "StackClient is not running"
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, coro: typing.Coroutine):
+        """Schedules the coroutine on the background loop without waiting, returns a concurrent.futures.Future"""
+        assert self.loop is not None, "StackClient is not running"
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Only the loop thread creates and uses the client
+        if self.client is None:
+            self.client = self._create_client()
+
+        host = urllib.parse.urlsplit(url).hostname
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.connections_per_stack)
+
+        async with limit:
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        kwargs.setdefault("timeout", WRITE_TIMEOUT)
+        return await self.request("POST", url, **kwargs)
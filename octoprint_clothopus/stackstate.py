@@ -0,0 +1,72 @@
+import math
+import struct
+import typing
+
+# Combined state frame of the stack's /state endpoint (all big-endian):
+#   uint8   version
+#   uint8   flags
+#   uint8   UID length, followed by the UID (ASCII, as reported by /sysinfo)
+#   float32 filament length consumed since the last tag write, in mm
+#   uint16  tag image length, followed by the tag image (absent without FLAG_TAG_PRESENT)
+STATE_FRAME_VERSION = 1
+FLAG_TAG_PRESENT = 0x01
+
+_header = struct.Struct(">BBB")
+_consumed = struct.Struct(">f")
+_image_length = struct.Struct(">H")
+
+
+class StackState(typing.NamedTuple):
+    """A single read of a stack. None fields were not provided by the stack and have to be fetched from the legacy endpoints."""
+
+    image: bytes | None  # None if there is no tag on the stack
+    uid: str | None = None
+    consumed_length: float | None = None  # mm
+
+
+def encode_state_frame(state: StackState) -> bytes:
+    uid = state.uid.encode("ascii")
+    assert len(uid) <= 0xFF, "UID too long"
+
+    frame = bytearray(_header.pack(STATE_FRAME_VERSION, FLAG_TAG_PRESENT if state.image is not None else 0, len(uid)))
+    frame += uid
+    frame += _consumed.pack(state.consumed_length)
+
+    if state.image is not None:
+        assert len(state.image) <= 0xFFFF, "Tag image too long"
+        frame += _image_length.pack(len(state.image))
+        frame += state.image
+
+    return bytes(frame)
+
+
+def decode_state_frame(frame: bytes) -> StackState:
+    frame = memoryview(frame)
+    assert len(frame) >= _header.size, "State frame too short"
+
+    version, flags, uid_length = _header.unpack_from(frame, 0)
+    assert version == STATE_FRAME_VERSION, f"Unsupported state frame version {version}"
+
+    pos = _header.size
+    assert len(frame) >= pos + uid_length + _consumed.size, "State frame too short"
+    uid = bytes(frame[pos : pos + uid_length]).decode("ascii")
+    pos += uid_length
+
+    consumed_length = _consumed.unpack_from(frame, pos)[0]
+    pos += _consumed.size
+
+    image = None
+    if flags & FLAG_TAG_PRESENT:
+        assert len(frame) >= pos + _image_length.size, "State frame too short"
+        image_length = _image_length.unpack_from(frame, pos)[0]
+        pos += _image_length.size
+
+        assert len(frame) >= pos + image_length, "State frame too short"
+        image = bytes(frame[pos : pos + image_length])
+
+    return StackState(image=image, uid=uid, consumed_length=consumed_length)
+
+
+def consumed_weight(length: float, filament_diameter: float, density: float) -> float:
+    """Converts a consumed filament length (mm) to grams, the same way the stack's /consumed endpoint does"""
+    return length * math.pi * (filament_diameter / 2) ** 2 * density / 1000
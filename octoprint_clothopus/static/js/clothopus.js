@@ -3,11 +3,28 @@ $(function() {
         var self = this;
         self.p0 = parameters[0];
         self.stacksArray = ko.observableArray();
-        self._filamentPollTimer = null;
-        self._filamentPollMs = 15000
+        self._emptyWizardOpen = false;
+        // MACs of the empty stacks the wizard was closed for, it isn't shown again for the same ones
+        self._dismissedEmpty = null;
+        self._tabActive = false;
         self.filamentRows = ko.observableArray([]);
         self.aliveDevices = ko.observableArray([]);
         self.currentEmptyStacks = ko.observableArray([]);
+        self.stackHealth = ko.observable({});
+
+        self.stackStatus = function (mac) {
+            const health = self.stackHealth()[mac];
+            return health ? health.status : "unknown";
+        };
+
+        self.unhealthyStacks = ko.pureComputed(function () {
+            const health = self.stackHealth();
+            return Object.keys(health).filter(function (mac) {
+                return health[mac].status !== "ok";
+            }).map(function (mac) {
+                return mac + " (" + health[mac].status + ")";
+            });
+        });
 
         self.refreshAliveDevices = function () {
             console.log("Refreshing alive devices");
@@ -29,12 +46,43 @@ $(function() {
             $("#clothopus_esp_wizard").modal("show");
         }
 
+        self.emptyStacksKey = function (empties) {
+            return empties.map(function (stack) {
+                return stack.mac;
+            }).sort().join(",");
+        };
+
+        // Snapshots are pushed on every tab, the wizard only opens on top of the Clothopus tab
+        self.showEmptyWizard = function () {
+            const empties = self.currentEmptyStacks();
+            const key = self.emptyStacksKey(empties);
+            // Once the empty stacks change (e.g. the tags were written), the dismissal is over
+            if (key !== self._dismissedEmpty) {
+                self._dismissedEmpty = null;
+            }
+            if (self._emptyWizardOpen || empties.length === 0 || key === self._dismissedEmpty) {
+                return;
+            }
+            if (!self._tabActive || $("#settings_dialog").is(":visible")) {
+                return;
+            }
+            $("#clothopus_empty_wizard").modal("show");
+            self._emptyWizardOpen = true;
+        };
+
+        // Closing by Cancel, Escape or the backdrop all end up in onEmptyWizardHidden
         self.closeEmptyWizard = function() {
-            self.currentEmptyStacks([])
             $("#clothopus_empty_wizard").modal("hide");
-            self.startFilamentPolling();
         }
 
+        self.onEmptyWizardHidden = function () {
+            // Also after a submit, the snapshot may still list the stacks until the next poll
+            self._dismissedEmpty = self.emptyStacksKey(self.currentEmptyStacks());
+            self._emptyWizardOpen = false;
+            self.currentEmptyStacks([]);
+            self.fetchFilaments();
+        };
+
         self.submitEmptyWizard = function() {
             OctoPrint.simpleApiCommand(
                 "clothopus",
@@ -43,6 +91,17 @@ $(function() {
                 if (resp.success) {
                     self.closeEmptyWizard();
                 } else {
+                    // Keep only the stacks that failed in the wizard
+                    const failed = (resp.results || []).filter(function (result) {
+                        return !result.success;
+                    }).map(function (result) {
+                        return result.mac;
+                    });
+                    if (failed.length > 0) {
+                        self.currentEmptyStacks(self.currentEmptyStacks().filter(function (stack) {
+                            return failed.indexOf(stack.mac) !== -1;
+                        }));
+                    }
                     new PNotify({
                         title: "Error",
                         text: resp.error || "Unknown error",
@@ -96,53 +155,54 @@ $(function() {
             });
         }
 
+        self.applyFilaments = function (resp) {
+            self.stackHealth(resp.health || {});
+            if (resp.success) {
+                self.filamentRows(resp.rows || []);
+                // Don't replace the stacks while the user is filling in the wizard
+                if (!self._emptyWizardOpen) {
+                    self.currentEmptyStacks(resp.empty || []);
+                    self.showEmptyWizard();
+                }
+            } else {
+                new PNotify({
+                    title: "Error",
+                    text: resp.error || "Unknown error",
+                    type: "error"
+                });
+            }
+        };
+
+        // Returns the server's last snapshot, updates are pushed by onDataUpdaterPluginMessage
         self.fetchFilaments = function () {
             OctoPrint.simpleApiCommand(
                 "clothopus",
                 "fetch_filaments"
-            ).done(function (resp) {
-                if (resp.success) {
-                    self.filamentRows(resp.rows || []);
-                    if (resp.empty.length > 0) {
-                        self.currentEmptyStacks(resp.empty)
-                        $("#clothopus_empty_wizard").modal("show");
-                        self.stopFilamentPolling();
-                    }
-                } else {
-                    new PNotify({
-                        title: "Error",
-                        text: resp.error || "Unknown error",
-                        type: "error"
-                    });
-                }
-            });
+            ).done(self.applyFilaments);
         };
 
-        self.startFilamentPolling = function () {
-            if (self._filamentPollTimer) return;
-            self.fetchFilaments();
-            self._filamentPollTimer = setInterval(function () {
-                if ($("#tab_plugin_clothopus").is(":visible")) { // sanity check
-                    self.fetchFilaments();
-                }
-            }, self._filamentPollMs);
+        self.onDataUpdaterPluginMessage = function (plugin, data) {
+            if (plugin !== "clothopus") return;
+            if (data.type === "filaments") {
+                self.applyFilaments(data);
+            }
         };
 
-        self.stopFilamentPolling = function () {
-            if (!self._filamentPollTimer) return;
-            clearInterval(self._filamentPollTimer);
-            self._filamentPollTimer = null;
+        self.onSettingsShown = function () {
+            self.fetchFilaments();
         };
 
         self.onTabChange = function (current, previous) {
-            if (current === "#tab_plugin_clothopus") {
-                self.startFilamentPolling();
-            } else if (previous === "#tab_plugin_clothopus") {
-                self.stopFilamentPolling();
+            self._tabActive = current === "#tab_plugin_clothopus";
+            if (self._tabActive) {
+                self.fetchFilaments();
             }
         };
 
         self.onAfterBinding = function () {
+            self._tabActive = $("#tab_plugin_clothopus").hasClass("active");
+            $("#clothopus_empty_wizard").on("hidden", self.onEmptyWizardHidden);
+
             self.settings = self.p0.settings
             const stacks = self.settings.plugins.clothopus.stacks || {};
             const rows = Object.keys(stacks).map(function (mac) {
@@ -0,0 +1,38 @@
+import dataclasses
+import hashlib
+import threading
+
+
+def image_digest(image: bytes | memoryview) -> bytes:
+    return hashlib.blake2b(image, digest_size=16).digest()
+
+
+@dataclasses.dataclass
+class TagCacheEntry:
+    digest: bytes
+
+    # Result of PrintTagHandler.bin_to_dict for the image, including the opt_check result
+    row: dict
+
+
+class TagCache:
+    """Last decoded tag per MAC, keyed on the hash of the tag image. Most polls return the same image as the previous one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, TagCacheEntry] = dict()
+
+    def get(self, mac: str, digest: bytes) -> TagCacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(mac)
+            return entry if entry is not None and entry.digest == digest else None
+
+    def put(self, mac: str, digest: bytes, row: dict) -> TagCacheEntry:
+        entry = TagCacheEntry(digest, row)
+        with self._lock:
+            self._entries[mac] = entry
+        return entry
+
+    def forget(self, mac: str):
+        with self._lock:
+            self._entries.pop(mac, None)
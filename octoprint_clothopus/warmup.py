@@ -0,0 +1,22 @@
+import importlib
+import logging
+import threading
+
+# Dependencies that are only imported on first use, not while OctoPrint loads the plugin.
+# httpx pulls in rich when it is installed, OPTag yaml, cbor2, ndef and requests.
+HEAVY_MODULES = ("httpx", "octoprint_clothopus.OPTag")
+
+
+def warm_up(modules: tuple[str, ...] = HEAVY_MODULES) -> threading.Thread:
+    """Imports the modules in a background thread, so that their first use doesn't have to wait for them"""
+
+    def run():
+        for module in modules:
+            try:
+                importlib.import_module(module)
+            except Exception:
+                logging.getLogger(__name__).exception(f"Importing {module} failed")
+
+    thread = threading.Thread(target=run, name="clothopus-warmup", daemon=True)
+    thread.start()
+    return thread
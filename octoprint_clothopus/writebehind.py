@@ -0,0 +1,57 @@
+import dataclasses
+import threading
+import time
+
+
+@dataclasses.dataclass(frozen=True)
+class FlushPolicy:
+    # Seconds a consumed weight may stay off the tag
+    interval: float = 600.0
+
+    # Pending grams that are written right away
+    weight_threshold: float = 5.0
+
+
+class WriteBehind:
+    """Decides when consumed weight is written to the tags.
+
+    The stack keeps counting the consumption until a tag write with_weight resets it, so the pending delta of a stack is simply its current count.
+    Deferring the write coalesces all the deltas in between into a single tag write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # mac -> (monotonic time since which weight is pending, pending grams)
+        self._pending: dict[str, tuple[float, float]] = dict()
+
+        # Weight pending since before this time is written with the next poll (print end, shutdown)
+        self._flush_requested_at = 0.0
+
+    def should_flush(self, mac: str, pending: float, policy: FlushPolicy) -> bool:
+        """Records the pending weight of the stack, returns whether it should be written to the tag now"""
+        with self._lock:
+            if pending == 0:
+                self._pending.pop(mac, None)
+                return False
+
+            since = self._pending[mac][0] if mac in self._pending else time.monotonic()
+            self._pending[mac] = (since, pending)
+
+            return abs(pending) >= policy.weight_threshold or time.monotonic() - since >= policy.interval or since <= self._flush_requested_at
+
+    def written(self, mac: str):
+        with self._lock:
+            self._pending.pop(mac, None)
+
+    def request_flush(self):
+        with self._lock:
+            self._flush_requested_at = time.monotonic()
+
+    def pending(self, mac: str) -> float:
+        with self._lock:
+            return self._pending[mac][1] if mac in self._pending else 0.0
+
+    def forget(self, mac: str):
+        with self._lock:
+            self._pending.pop(mac, None)